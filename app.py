@@ -3,7 +3,7 @@
     TELEGRAM UNIFIED SYSTEM - COMPLETE VERSION
     
     Features:
-    ✅ 60-second MESSAGE BUFFER system
+    ✅ MESSAGE BUFFER system (per-group flush policies, 60s default)
     ✅ User management (add/extend/remove)
     ✅ Multi-database support (SQLite for local, PostgreSQL for production)
     ✅ Real-time dashboard
@@ -14,18 +14,261 @@
 ═══════════════════════════════════════════════════════════════════════════
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
+# Stays eager: CORS must hook the app before its first request, and costs ~1ms on top of Flask
 from flask_cors import CORS
-import requests
-from datetime import datetime, timedelta
+from datetime import datetime
 import time
 import os
+import json
+import re
 import threading
-from collections import defaultdict
+import functools
+import hashlib
+import itertools
+import bisect
+import logging
+import logging.handlers
+import random
+import socket
+import sys
+import uuid
+import atexit
+import queue
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
 
+# ═══════════════════════════════════════════════════════════════════════════
+# 📝 LOGGING
+# ═══════════════════════════════════════════════════════════════════════════
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()               # 'json' for log drains
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_KEYWORD_SAMPLE_RATE = float(os.environ.get('LOG_KEYWORD_SAMPLE_RATE', 0.01))   # Share of per-keyword DEBUG lines kept
+
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def log_fields(record):
+    """Structured fields passed via extra={...}"""
+    return {k: v for k, v in vars(record).items() if k not in _LOG_RECORD_ATTRS}
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line - message, level and any extra fields"""
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'msg': record.getMessage()
+        }
+        entry.update(log_fields(record))
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextLogFormatter(logging.Formatter):
+    """Console line with extra fields appended as key=value"""
+    def format(self, record):
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {record.getMessage()}"
+        fields = log_fields(record)
+        if fields:
+            line += '  ' + ' '.join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread - never blocks, counts drops when the queue is full"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message now (args may change later); formatting happens on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging():
+    """Route the app logger through a queue so request and flush threads never wait on stdout.
+    
+    Records queue up until start_log_listener() starts the thread that writes them."""
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    
+    handler = DroppingQueueHandler(log_queue)
+    logger = logging.getLogger('telegram_system')
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    return logger, handler, listener
+
+log, log_handler, log_listener = setup_logging()
+log_listener_started = False
+log_listener_lock = threading.Lock()
+
+def start_log_listener():
+    """Start writing queued log records (once per process)"""
+    global log_listener_started
+    with log_listener_lock:
+        if not log_listener_started:
+            log_listener.start()
+            atexit.register(log_listener.stop)
+            log_listener_started = True
+
+def log_sampled(rate):
+    """True for roughly `rate` of calls - keeps very chatty DEBUG lines affordable"""
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📈 METRICS
+# ═══════════════════════════════════════════════════════════════════════════
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120, 300)   # Seconds - covers match time up to time-in-buffer
+
+metrics_registry = []   # Rendered in registration order by /metrics
+
+def format_labels(labelnames, labels):
+    """{a="1",b="2"} in Prometheus text format (empty string without labels)"""
+    if not labelnames:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{n}="{escape(v)}"' for n, v in zip(labelnames, labels)) + '}'
+
+class Counter:
+    """Monotonic counter, one series per label tuple"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = defaultdict(float)
+        if not labelnames:
+            self._values[()] = 0   # Export 0 before the first increment
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name + format_labels(self.labelnames, labels), value
+
+class Histogram:
+    """Fixed-bucket histogram - observe() is a bisect plus three additions under a lock"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        names = self.labelnames + ('le',)
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                yield self.name + '_bucket' + format_labels(names, labels + (bound,)), cumulative
+            yield self.name + '_sum' + format_labels(self.labelnames, labels), total
+            yield self.name + '_count' + format_labels(self.labelnames, labels), count
+
+class CallbackMetric:
+    """Metric read at scrape time - collect() returns {label_tuple: value}"""
+
+    def __init__(self, name, help_text, collect, labelnames=(), kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.kind = kind
+        self.collect = collect
+        metrics_registry.append(self)
+
+    def samples(self):
+        for labels, value in self.collect().items():
+            yield self.name + format_labels(self.labelnames, labels), value
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for series, value in metric.samples():
+            lines.append(f"{series} {value:g}" if isinstance(value, float) else f"{series} {value}")
+    return '\n'.join(lines) + '\n'
+
+def timed(histogram, *labels):
+    """Decorator - records each call's duration (seconds) in histogram"""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+        
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+def db_timed(fn):
+    """Decorator - records a database helper's latency under its function name"""
+    return timed(db_query_seconds, fn.__name__)(fn)
+
+webhook_request_seconds = Histogram('webhook_request_seconds', 'Time to answer POST /webhook/router')
+keyword_match_seconds = Histogram('keyword_match_seconds', 'Time to match one alert against all group keywords')
+alerts_routed_total = Counter('alerts_routed_total', 'Alerts buffered per group', ('group',))
+alerts_unmatched_total = Counter('alerts_unmatched_total', 'Alerts that matched no group')
+buffer_wait_seconds = Histogram('buffer_wait_seconds', 'Time an alert spent buffered before delivery', ('group',))
+flush_duration_seconds = Histogram('flush_duration_seconds', 'Duration of one flush cycle across all due groups')
+telegram_request_seconds = Histogram('telegram_request_seconds', 'Bot API call latency', ('method',))
+telegram_responses_total = Counter('telegram_responses_total', 'Bot API calls by HTTP status (exception = no response)',
+                                   ('method', 'code'))
+db_query_seconds = Histogram('db_query_seconds', 'Latency of database helper functions', ('helper',))
+CallbackMetric('log_records_dropped_total', 'Log records dropped because the log queue was full',
+               lambda: {(): log_handler.dropped}, kind='counter')
+
 # ═══════════════════════════════════════════════════════════════════════════
 # 🔧 CONFIGURATION
 # ═══════════════════════════════════════════════════════════════════════════
@@ -41,13 +284,13 @@ USE_LOCAL_SQLITE = os.environ.get('USE_LOCAL_SQLITE', 'True').lower() == 'true'
 if USE_LOCAL_SQLITE:
     DATABASE_TYPE = 'sqlite'
     DATABASE_URL = 'unified_system.db'
-    print("🔧 Using LOCAL SQLite database")
+    log.info("🔧 Using LOCAL SQLite database")
 else:
     DATABASE_TYPE = os.environ.get('DATABASE_TYPE', 'postgresql')
     DATABASE_URL = os.environ.get('DATABASE_URL', '')
     
     if not DATABASE_URL:
-        print("⚠️ DATABASE_URL not set, falling back to SQLite")
+        log.warning("⚠️ DATABASE_URL not set, falling back to SQLite")
         DATABASE_TYPE = 'sqlite'
         DATABASE_URL = 'unified_system.db'
     else:
@@ -56,7 +299,7 @@ else:
             DATABASE_TYPE = 'postgresql'
             if DATABASE_URL.startswith('postgres://'):
                 DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
-        print(f"🔧 Using {DATABASE_TYPE.upper()} database from environment")
+        log.info(f"🔧 Using {DATABASE_TYPE.upper()} database from environment")
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 📋 GROUPS CONFIGURATION
@@ -125,80 +368,973 @@ GROUPS = {
     }
 }
 
+# ═══════════════════════════════════════════════════════════════════════════
+# 🔀 KEYWORD ROUTER
+# ═══════════════════════════════════════════════════════════════════════════
+#
+# Optional per-group routing rules (add to a GROUPS entry):
+#   'priority': 10          - higher priority groups are routed first (default 0)
+#   'word_boundary': True   - keyword must be a whole word, e.g. GOLD won't match GOLDBEES
+
+ROUTER_RECHECK_SECONDS = 1.0   # How often match() re-checks GROUPS for edits
+
+def _trie_regex(keywords):
+    """Build a prefix-trie regex (e.g. GOLD(?:EN)?|SILVER) - far cheaper to scan than a flat alternation"""
+    trie = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        terminal = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if terminal:
+            # Greedy optional tail -> longest keyword wins at a given position
+            body = body + '?' if len(branches) == 1 and len(branches[0]) == 1 else '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+class KeywordRouter:
+    """Compiles every enabled group's keywords into one regex - one pass finds all destinations"""
+
+    def __init__(self, groups):
+        self._groups = groups
+        self._fingerprint = None
+        # (pattern, index, prefixes, order) swapped in as one tuple so readers never see a half-built state:
+        #   index:    KEYWORD -> [(group_key, keyword_position, keyword, word_boundary)]
+        #   prefixes: KEYWORD -> keywords that are prefixes of it (incl. itself)
+        #   order:    group_key -> sort key (priority, config order)
+        self._compiled = (None, {}, {}, {})
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self.rebuilds = 0
+
+    def invalidate(self):
+        """Force a rebuild on the next match() - call after editing GROUPS at runtime"""
+        self._fingerprint = None
+        self._checked_at = 0.0
+
+    def _current_fingerprint(self):
+        return tuple(
+            (key, cfg['enabled'], tuple(cfg['keywords']), cfg.get('priority', 0), cfg.get('word_boundary', False))
+            for key, cfg in self._groups.items()
+        )
+
+    def _rebuild(self, fingerprint):
+        index = defaultdict(list)
+        order = {}
+
+        for position, (key, cfg) in enumerate(self._groups.items()):
+            if not cfg['enabled']:
+                continue
+            order[key] = (-cfg.get('priority', 0), position)
+            for kw_position, keyword in enumerate(cfg['keywords']):
+                if keyword:
+                    index[keyword.upper()].append((key, kw_position, keyword, cfg.get('word_boundary', False)))
+
+        # Longest match wins at each position; shorter keywords starting at the
+        # same position are recovered via the prefixes map
+        keywords = sorted(index, key=len, reverse=True)
+        prefixes = {kw: [other for other in keywords if kw.startswith(other)] for kw in keywords}
+        pattern = re.compile(_trie_regex(keywords)) if keywords else None
+
+        self._compiled = (pattern, dict(index), prefixes, order)
+        self._fingerprint = fingerprint
+        self.rebuilds += 1
+
+    @timed(keyword_match_seconds)
+    def match(self, message_upper):
+        """Return [(group_key, group_config, keyword)] for every group matched, highest priority first"""
+        now = time.monotonic()
+        if now - self._checked_at > ROUTER_RECHECK_SECONDS:
+            fingerprint = self._current_fingerprint()
+            if fingerprint != self._fingerprint:
+                with self._lock:
+                    if fingerprint != self._fingerprint:
+                        self._rebuild(fingerprint)
+            self._checked_at = now
+
+        pattern, index, prefixes, order = self._compiled
+        if pattern is None:
+            return []
+
+        best = {}   # group_key -> (keyword_position, keyword)
+        length = len(message_upper)
+        search = pattern.search
+        m = search(message_upper)
+        while m:
+            start = m.start()
+            for kw_upper in prefixes[m.group()]:
+                end = start + len(kw_upper)
+                for key, kw_position, keyword, word_boundary in index[kw_upper]:
+                    if word_boundary and (
+                        (start > 0 and message_upper[start - 1].isalnum()) or
+                        (end < length and message_upper[end].isalnum())
+                    ):
+                        continue
+                    if key not in best or kw_position < best[key][0]:
+                        best[key] = (kw_position, keyword)
+            # Resume one character later so overlapping keywords are still found
+            m = search(message_upper, start + 1)
+
+        return [
+            (key, self._groups[key], best[key][1])
+            for key in sorted(best, key=lambda k: order[k])
+        ]
+
+keyword_router = KeywordRouter(GROUPS)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📡 EVENT STREAM
+# ═══════════════════════════════════════════════════════════════════════════
+
+SSE_HEARTBEAT_SECONDS = 15      # Comment line that keeps idle proxies from closing the stream
+SSE_CLIENT_QUEUE_SIZE = 200     # Events held per client before it is treated as too slow
+SSE_COALESCE_SECONDS = 0.25     # Buffer changes within this window are pushed as one update
+
+class EventBroker:
+    """Fan-out of dashboard events to Server-Sent Events subscribers"""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._buffer_dirty = threading.Event()
+        self._buffer_thread = None
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+            if self._buffer_thread is None:
+                self._buffer_thread = threading.Thread(target=self._buffer_loop, daemon=True)
+                self._buffer_thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data):
+        """Send an event to every subscriber (no-op without subscribers)"""
+        if not self._subscribers:
+            return
+        payload = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        
+        for q in subscribers:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                # Too slow - end its stream; EventSource reconnects and reloads full state
+                self.unsubscribe(q)
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(None)
+
+    def buffer_changed(self):
+        """Schedule a coalesced 'buffer' event"""
+        if self._subscribers:
+            self._buffer_dirty.set()
+
+    def _buffer_loop(self):
+        while True:
+            self._buffer_dirty.wait()
+            time.sleep(SSE_COALESCE_SECONDS)
+            self._buffer_dirty.clear()
+            try:
+                self.publish('buffer', buffer_state())
+            except Exception:
+                log.exception("❌ Event stream error")
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+event_broker = EventBroker()
+CallbackMetric('sse_subscribers', 'Open /api/events streams', lambda: {(): event_broker.subscriber_count()})
+
 # ═══════════════════════════════════════════════════════════════════════════
 # ⏳ BUFFER SYSTEM
 # ═══════════════════════════════════════════════════════════════════════════
 
+FLUSH_WORKERS = int(os.environ.get('FLUSH_WORKERS', 8))   # Groups sent concurrently per flush
+BUFFER_WAL_PATH = os.environ.get('BUFFER_WAL_PATH', 'buffer_wal.db')   # Durable copy of the buffer ('' disables)
+BUFFER_MAX_ATTEMPTS = int(os.environ.get('BUFFER_MAX_ATTEMPTS', 5))   # Flush cycles before a failing batch is dropped
+BUFFER_BACKEND = os.environ.get('BUFFER_BACKEND', 'memory').lower()   # 'memory' (single worker) or 'sql' (shared by all workers)
+BUFFER_POLL_SECONDS = float(os.environ.get('BUFFER_POLL_SECONDS', 1))     # sql backend: how often other workers' alerts are picked up
+BUFFER_CLAIM_SECONDS = float(os.environ.get('BUFFER_CLAIM_SECONDS', 120))  # sql backend: flush lease on a group (taken over after a crash)
+
+# Default flush policy - any GROUPS entry can override these with a 'flush' dict, e.g.
+#   'flush': {'max_latency': 10, 'max_batch': 5, 'immediate_keywords': ['STOPLOSS']}
+FLUSH_MAX_LATENCY = float(os.environ.get('FLUSH_MAX_LATENCY', 60))   # Seconds the oldest alert may wait
+FLUSH_MAX_BATCH = int(os.environ.get('FLUSH_MAX_BATCH', 50))          # Flush once this many alerts are waiting
+FLUSH_MAX_CHARS = int(os.environ.get('FLUSH_MAX_CHARS', 4096))        # Telegram's message length limit
+FLUSH_IMMEDIATE_KEYWORDS = [k.strip().upper() for k in os.environ.get('FLUSH_IMMEDIATE_KEYWORDS', '').split(',') if k.strip()]
+BATCH_SEPARATOR = "\n\n\n"
+MESSAGE_LOG_PER_ALERT = os.environ.get('MESSAGE_LOG_PER_ALERT', 'False').lower() == 'true'   # Also log each alert in alert_log
+
 message_buffer = defaultdict(list)
 buffer_lock = threading.Lock()
+buffer_cond = threading.Condition(buffer_lock)   # Wakes the scheduler when a group becomes due
+urgent_groups = set()        # Groups holding an immediate-send alert
+groups_in_flight = set()     # Groups with a send in progress (flushed one batch at a time)
+retry_not_before = {}        # gid -> monotonic time a requeued batch may be retried
 last_batch_time = datetime.now()
+last_flush = {}   # Latency report of the most recent flush (see /api/buffer)
+flush_executor = ThreadPoolExecutor(max_workers=FLUSH_WORKERS, thread_name_prefix='flush')
+
+def pending_buffer():
+    """Buffered alerts per group - the shared table when BUFFER_BACKEND=sql"""
+    if shared_buffer:
+        return shared_buffer.load()
+    with buffer_lock:
+        return {gid: list(msgs) for gid, msgs in message_buffer.items() if msgs}
+
+def collect_buffer_depth():
+    """Buffered alerts per group for the buffer_depth gauge"""
+    if shared_buffer and not db_ready.is_set():
+        return {}   # Cold start: the buffer table may not exist yet, and scrapes must not wait for it
+    depth = {gid: len(msgs) for gid, msgs in pending_buffer().items()}
+    names = {config['group_id']: config['name'] for config in GROUPS.values()}
+    return {(names.get(gid, gid),): count for gid, count in depth.items()}
+
+CallbackMetric('buffer_depth', 'Alerts waiting in the buffer per group', collect_buffer_depth, ('group',))
+
+class BufferWAL:
+    """Append-only SQLite (WAL mode) log of buffered alerts.
+    
+    Entries are written by a single writer thread that commits whatever has
+    queued up since its last commit (group commit), so add_to_buffer never
+    waits on disk. Entries are deleted (acked) only after a successful send
+    and replayed into message_buffer on startup."""
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        self._queue = queue.Queue()
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS buffer_entries (
+                id INTEGER PRIMARY KEY,
+                group_id TEXT,
+                group_name TEXT,
+                keyword TEXT,
+                message TEXT,
+                received_at TEXT
+            )
+        ''')
+        conn.commit()
+        max_id = conn.execute('SELECT MAX(id) FROM buffer_entries').fetchone()[0] or 0
+        conn.close()
+        self._ids = itertools.count(max_id + 1)
+        self.commits = 0
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def next_id(self):
+        return next(self._ids)
+
+    def append(self, entry):
+        self._queue.put(('append', entry))
+
+    def ack(self, ids):
+        if ids:
+            self._queue.put(('ack', ids))
+
+    def load(self):
+        """Unacknowledged entries in arrival order"""
+        import sqlite3
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute('''
+            SELECT id, group_id, group_name, keyword, message, received_at
+            FROM buffer_entries ORDER BY id
+        ''').fetchall()
+        conn.close()
+        return rows
+
+    def _write_loop(self):
+        import sqlite3
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA synchronous=NORMAL')   # WAL: fsync on checkpoint, not every commit
+        
+        while True:
+            ops = [self._queue.get()]
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                for op, payload in ops:
+                    if op == 'append':
+                        conn.execute('''
+                            INSERT OR REPLACE INTO buffer_entries (id, group_id, group_name, keyword, message, received_at)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', (payload['id'], payload['group_id'], payload['group_name'],
+                              payload['keyword'], payload['message'], payload['received_at']))
+                    else:
+                        conn.executemany('DELETE FROM buffer_entries WHERE id = ?', [(i,) for i in payload])
+                conn.commit()
+                self.commits += 1
+            except Exception:
+                log.exception("❌ Buffer WAL write error", extra={'path': self.path})
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+
+buffer_wal = None   # BufferWAL(BUFFER_WAL_PATH), opened by start_background_workers
+
+class SQLBuffer:
+    """Buffer kept in the shared database (buffer_queue table) for multi-worker / multi-instance setups.
+    
+    Any process may add alerts. A process flushes a group only after winning a lease row
+    in buffer_claims (an atomic upsert that succeeds only when no live lease exists), so
+    exactly one flusher drains each group at a time. Leases expire after
+    BUFFER_CLAIM_SECONDS, so a crashed worker's groups are picked up by another; a live
+    flusher renews its leases while it sends."""
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _placeholder(self):
+        return '?' if DATABASE_TYPE == 'sqlite' else '%s'
+
+    def _run(self, sql, params=(), many=False, fetch=False):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            if many:
+                cursor.executemany(sql, params)
+            else:
+                cursor.execute(sql, params)
+            result = cursor.fetchall() if fetch else cursor.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def add(self, group_id, entry, urgent):
+        p = self._placeholder()
+        self._run(f'''
+            INSERT INTO buffer_queue (group_id, group_name, keyword, message, received_at, queued_at, urgent)
+            VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p})
+        ''', (group_id, entry['group_name'], entry['keyword'], entry['message'],
+              to_epoch(entry['received_at']), time.time(), int(urgent)))
+
+    def _group_summaries(self, now, unclaimed_only):
+        """(group_id, oldest queued_at, count, chars, urgent, not_before) per group"""
+        p = self._placeholder()
+        claimed = f'''
+            WHERE NOT EXISTS (SELECT 1 FROM buffer_claims c
+                              WHERE c.group_id = q.group_id AND c.expires_at > {p})
+        ''' if unclaimed_only else ''
+        return self._run(f'''
+            SELECT q.group_id, MIN(q.queued_at), COUNT(*), SUM(LENGTH(q.message)), MAX(q.urgent), MAX(q.not_before)
+            FROM buffer_queue q {claimed}
+            GROUP BY q.group_id
+        ''', (now,) if unclaimed_only else (), fetch=True)
+
+    def find_due(self, now, unclaimed_only=True):
+        """Same rules as find_due_groups, evaluated on per-group aggregates"""
+        due = []
+        next_in = None
+        for gid, oldest, count, chars, urgent, not_before in self._group_summaries(now, unclaimed_only):
+            policy = get_flush_policy(gid)
+            retry_at = not_before or 0
+            deadline = max(oldest + policy['max_latency'], retry_at)
+            chars = (chars or 0) + len(BATCH_SEPARATOR) * max(0, count - 1)
+            if now >= retry_at and (now >= deadline or urgent or
+                    count >= policy['max_batch'] or chars >= policy['max_chars']):
+                due.append(gid)
+            elif next_in is None or deadline - now < next_in:
+                next_in = deadline - now
+        return due, next_in
+
+    def claim(self, gid, now, seconds=BUFFER_CLAIM_SECONDS):
+        """Take the flush lease on a group - False if another live flusher holds it"""
+        p = self._placeholder()
+        return self._run(f'''
+            INSERT INTO buffer_claims (group_id, owner, expires_at) VALUES ({p}, {p}, {p})
+            ON CONFLICT (group_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE buffer_claims.expires_at <= {p}
+        ''', (gid, self.owner, now + seconds, now)) == 1
+
+    def renew(self, gid, seconds=BUFFER_CLAIM_SECONDS):
+        """Extend our lease on a group - False if it lapsed and another worker took it over"""
+        p = self._placeholder()
+        return self._run(f'UPDATE buffer_claims SET expires_at = {p} WHERE group_id = {p} AND owner = {p}',
+                         (time.time() + seconds, gid, self.owner)) == 1
+
+    def release(self, gid):
+        p = self._placeholder()
+        self._run(f'DELETE FROM buffer_claims WHERE group_id = {p} AND owner = {p}', (gid, self.owner))
+
+    def load(self, gid=None):
+        """Pending entries (in arrival order) shaped like in-process buffer entries"""
+        p = self._placeholder()
+        where, params = (f'WHERE group_id = {p}', (gid,)) if gid is not None else ('', ())
+        rows = self._run(f'''
+            SELECT id, group_id, group_name, keyword, message, received_at, queued_at, attempts
+            FROM buffer_queue {where} ORDER BY id
+        ''', params, fetch=True)
+        # queued_at is wall-clock (shared across hosts); entries carry it as local monotonic time
+        offset = time.time() - time.monotonic()
+        pending = defaultdict(list)
+        for entry_id, group_id, group_name, keyword, message, received_at, queued_at, attempts in rows:
+            pending[group_id].append({
+                'id': entry_id,
+                'message': message,
+                'group_name': group_name,
+                'keyword': keyword,
+                'received_at': format_epoch(received_at),
+                'queued_at': queued_at - offset,
+                'attempts': attempts
+            })
+        return pending
+
+    def claim_due(self):
+        """Lease and load every due group - returns ({gid: entries}, seconds until the next deadline)"""
+        now = time.time()
+        due, next_in = self.find_due(now)
+        snapshot = {}
+        for gid in due:
+            if self.claim(gid, now):
+                entries = self.load(gid).get(gid)
+                if entries:
+                    snapshot[gid] = entries
+                else:
+                    self.release(gid)
+        return snapshot, next_in
+
+    def ack(self, ids):
+        p = self._placeholder()
+        if ids:
+            self._run(f'DELETE FROM buffer_queue WHERE id = {p}', [(i,) for i in ids], many=True)
+
+    def requeue(self, msgs, not_before):
+        p = self._placeholder()
+        self._run(f'UPDATE buffer_queue SET attempts = {p}, not_before = {p} WHERE id = {p}',
+                  [(m['attempts'], not_before, m['id']) for m in msgs], many=True)
+
+shared_buffer = SQLBuffer() if BUFFER_BACKEND == 'sql' else None   # The sql backend is durable itself - no WAL
+db_ready = threading.Event()   # Set once init_database has created the tables
+
+def hold_job_lease(name, interval):
+    """True if this worker should run singleton job `name` now (always, with the memory backend).
+    
+    With the sql backend the job is leased like a group, under the pseudo group 'job:<name>'.
+    The lease outlives two intervals, so its holder keeps the job from run to run and another
+    worker takes it over only after the holder stops renewing."""
+    if not shared_buffer:
+        return True
+    key = f'job:{name}'
+    seconds = 2 * interval + BUFFER_CLAIM_SECONDS
+    try:
+        db_ready.wait()
+        return shared_buffer.renew(key, seconds) or shared_buffer.claim(key, time.time(), seconds)
+    except Exception:
+        log.exception("❌ Job lease error", extra={'job': name})
+        return False
+
+def get_flush_policy(group_id):
+    """Flush policy for a group: defaults overridden by its GROUPS 'flush' settings"""
+    policy = {
+        'max_latency': FLUSH_MAX_LATENCY,
+        'max_batch': FLUSH_MAX_BATCH,
+        'max_chars': FLUSH_MAX_CHARS,
+        'immediate_keywords': FLUSH_IMMEDIATE_KEYWORDS
+    }
+    for config in GROUPS.values():
+        if config['group_id'] == group_id:
+            policy.update(config.get('flush', {}))
+            break
+    policy['immediate_keywords'] = [k.upper() for k in policy['immediate_keywords']]
+    return policy
+
+def batch_chars(msgs):
+    """Length of the combined message these alerts would produce"""
+    return sum(len(m['message']) for m in msgs) + len(BATCH_SEPARATOR) * max(0, len(msgs) - 1)
 
 def add_to_buffer(group_id, group_name, message, keyword):
     """Add message to buffer for batching"""
+    entry = {
+        'message': message,
+        'group_name': group_name,
+        'keyword': keyword,
+        'received_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'queued_at': time.monotonic()
+    }
+    policy = get_flush_policy(group_id)
+    urgent = any(k in message.upper() for k in policy['immediate_keywords'])
+    
+    if shared_buffer:
+        shared_buffer.add(group_id, entry, urgent)
+        with buffer_cond:
+            buffer_cond.notify()   # Let this worker's scheduler check the group right away
+        log.debug("📥 Added to shared buffer", extra={'group': group_name, 'keyword': keyword})
+        event_broker.buffer_changed()
+        return
+    
+    if buffer_wal:
+        entry['id'] = buffer_wal.next_id()
+        buffer_wal.append(dict(entry, group_id=group_id))
+    
+    with buffer_cond:
+        msgs = message_buffer[group_id]
+        msgs.append(entry)
+        if urgent:
+            urgent_groups.add(group_id)
+        # Wake the scheduler for a new deadline (first alert) or a threshold hit
+        if urgent or len(msgs) == 1 or len(msgs) >= policy['max_batch'] or batch_chars(msgs) >= policy['max_chars']:
+            buffer_cond.notify()
+        log.debug("📥 Added to buffer", extra={'group': group_name, 'keyword': keyword, 'depth': len(msgs)})
+    event_broker.buffer_changed()
+
+def ack_buffered(msgs):
+    """Remove delivered (or abandoned) messages from the durable buffer"""
+    if shared_buffer:
+        shared_buffer.ack([m['id'] for m in msgs])
+    elif buffer_wal:
+        buffer_wal.ack([m['id'] for m in msgs if 'id' in m])
+
+def requeue_failed(gid, msgs):
+    """Put a failed batch back at the front of the buffer for the next cycle"""
+    retry = []
+    for m in msgs:
+        m['attempts'] = m.get('attempts', 0) + 1
+        if m['attempts'] < BUFFER_MAX_ATTEMPTS:
+            retry.append(m)
+    
+    dropped = [m for m in msgs if m['attempts'] >= BUFFER_MAX_ATTEMPTS]
+    if dropped:
+        log.error(f"🗑️ Dropping message(s) after {BUFFER_MAX_ATTEMPTS} failed attempts",
+                  extra={'group': msgs[0]['group_name'], 'count': len(dropped)})
+        ack_buffered(dropped)
+    
+    if retry:
+        if shared_buffer:
+            shared_buffer.requeue(retry, time.time() + get_flush_policy(gid)['max_latency'])
+        else:
+            with buffer_lock:
+                message_buffer[gid][:0] = retry
+                retry_not_before[gid] = time.monotonic() + get_flush_policy(gid)['max_latency']
+        event_broker.buffer_changed()
+        log.warning("🔁 Requeued failed batch", extra={'group': msgs[0]['group_name'], 'count': len(retry)})
+
+def replay_buffer_wal():
+    """Reload messages that were buffered but never sent before the last shutdown"""
+    if not buffer_wal:
+        return
+    rows = buffer_wal.load()
     with buffer_lock:
-        message_buffer[group_id].append({
-            'message': message,
-            'group_name': group_name,
-            'keyword': keyword,
-            'received_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for entry_id, group_id, group_name, keyword, message, received_at in rows:
+            message_buffer[group_id].append({
+                'id': entry_id,
+                'message': message,
+                'group_name': group_name,
+                'keyword': keyword,
+                'received_at': received_at,
+                'queued_at': time.monotonic()
+            })
+    if rows:
+        log.info("♻️ Replayed buffered messages", extra={'count': len(rows), 'path': buffer_wal.path})
+
+def split_long_alert(text, limit):
+    """Split a single alert longer than `limit` - at line breaks where possible"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text:
+        chunks.append(text)
+    return chunks
+
+def pack_batch(msgs, limit):
+    """Pack alerts, in order, into the fewest messages of at most `limit` characters.
+    
+    Greedy filling is optimal when alerts must keep their order. An alert is never
+    split across messages unless it alone exceeds the limit. Returns a list of
+    {'text', 'msgs', 'acks'}: 'msgs' are the alerts in the part, 'acks' the alerts
+    fully delivered once the part is sent (the last chunk of a split alert acks it)."""
+    parts = []
+    current = []
+    size = 0
+    
+    def close_current():
+        if current:
+            parts.append({
+                'text': BATCH_SEPARATOR.join(m['message'] for m in current),
+                'msgs': list(current),
+                'acks': list(current)
+            })
+    
+    for m in msgs:
+        length = len(m['message'])
+        
+        if length > limit:
+            close_current()
+            current, size = [], 0
+            chunks = split_long_alert(m['message'], limit)
+            for i, chunk in enumerate(chunks):
+                parts.append({'text': chunk, 'msgs': [m], 'acks': [m] if i == len(chunks) - 1 else []})
+            continue
+        
+        new_size = length if not current else size + len(BATCH_SEPARATOR) + length
+        if current and new_size > limit:
+            close_current()
+            current, size = [m], length
+        else:
+            current.append(m)
+            size = new_size
+    
+    close_current()
+    return parts
+
+def send_group_batch(gid, msgs, sent_log=None):
+    """Send one group's buffered messages, packed into as few messages as the length limit allows.
+    
+    Sent parts are appended to sent_log for a batched write at the end of the flush cycle
+    (written immediately when no sent_log is given)."""
+    started = time.monotonic()
+    group_name = msgs[0]['group_name']
+    
+    parts = pack_batch(msgs, get_flush_policy(gid)['max_chars'])
+    parts_sent = 0
+    
+    # Stream the parts in order - stop at the first failure and requeue everything not yet delivered
+    for part in parts:
+        if not renew_group_lease(gid):
+            # The lease lapsed mid-send: the new owner reloads and sends whatever is not acked yet
+            log.warning("⚠️ Lost buffer lease", extra={'group': group_name, 'parts_left': len(parts) - parts_sent})
+            break
+        if not send_to_telegram(gid, part['text']):
+            delivered = {id(m) for p in parts[:parts_sent] for m in p['acks']}
+            requeue_failed(gid, [m for m in msgs if id(m) not in delivered])
+            break
+        
+        ack_buffered(part['acks'])
+        parts_sent += 1
+        delivered_at = time.monotonic()
+        for m in part['acks']:
+            buffer_wait_seconds.observe(delivered_at - m['queued_at'], group_name)
+        # Log each part as its own message
+        record = (part['text'], gid, group_name,
+                  ", ".join(sorted(set([m['keyword'] for m in part['msgs']]))),
+                  [(m['keyword'], m['message'], m['received_at']) for m in part['acks']] if MESSAGE_LOG_PER_ALERT else [])
+        if sent_log is None:
+            log_messages([record])
+        else:
+            sent_log.append(record)
+    
+    sent = parts_sent == len(parts)
+    if sent:
+        log.info("✅ Sent batch", extra={
+            'group': group_name,
+            'messages': len(msgs),
+            'parts': len(parts),
+            'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            'oldest_wait_ms': round((time.monotonic() - min(m['queued_at'] for m in msgs)) * 1000, 1)
         })
-        print(f"📥 Added to buffer: {group_name} (Total: {len(message_buffer[group_id])})")
+    
+    return {
+        'group_id': gid,
+        'group_name': group_name,
+        'count': len(msgs),
+        'parts': len(parts),
+        'parts_sent': parts_sent,
+        'sent': sent,
+        'latency_ms': round((time.monotonic() - started) * 1000, 1)
+    }
 
-def process_buffer():
-    """Background thread - sends buffered messages every 60 seconds"""
-    global last_batch_time
-    print("🔄 Buffer thread starting...")
+def find_due_groups(now):
+    """Return (due group ids, seconds until the next deadline or None) - call with buffer_lock held"""
+    due = []
+    next_in = None
+    
+    for gid, msgs in message_buffer.items():
+        if not msgs or gid in groups_in_flight:
+            continue
+        policy = get_flush_policy(gid)
+        retry_at = retry_not_before.get(gid, 0)
+        deadline = max(msgs[0]['queued_at'] + policy['max_latency'], retry_at)
+        
+        if now >= retry_at and (now >= deadline or gid in urgent_groups or
+                len(msgs) >= policy['max_batch'] or batch_chars(msgs) >= policy['max_chars']):
+            due.append(gid)
+        elif next_in is None or deadline - now < next_in:
+            next_in = deadline - now
+    
+    return due, next_in
+
+def take_batch(gid):
+    """Pop all pending alerts of a group (packed into parts at send time) - call with buffer_lock held"""
+    batch = message_buffer.pop(gid, [])
+    urgent_groups.discard(gid)
+    retry_not_before.pop(gid, None)
+    return batch
+
+def renew_group_lease(gid):
+    """sql backend: keep our flush lease on a group - False once another worker owns it"""
+    if not shared_buffer:
+        return True
+    try:
+        return shared_buffer.renew(gid)
+    except Exception:
+        log.exception("❌ Buffer lease renewal error", extra={'group_id': gid})
+        return True   # The lease is still good until it expires
+
+def release_group(gid):
+    """Mark a group's send as finished so its next batch can be scheduled"""
+    if shared_buffer:
+        try:
+            shared_buffer.release(gid)
+        except Exception:
+            log.exception("❌ Buffer lease release error", extra={'group_id': gid})   # Lease expires on its own
+    with buffer_cond:
+        groups_in_flight.discard(gid)
+        buffer_cond.notify()
+
+@timed(flush_duration_seconds)
+def flush_buffer_snapshot(buffer_snapshot):
+    """Send all groups concurrently - rate limits are enforced inside send_to_telegram"""
+    global last_flush, last_batch_time
+    started = time.monotonic()
+    
+    futures = []
+    sent_log = []   # Filled by the send workers, written in one transaction below
+    for gid, msgs in buffer_snapshot.items():
+        future = flush_executor.submit(send_group_batch, gid, msgs, sent_log)
+        future.add_done_callback(lambda f, gid=gid: release_group(gid))
+        futures.append(future)
+    
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception:
+            log.exception("❌ Flush error")
+    
+    if sent_log:
+        try:
+            db_ready.wait(DB_READY_TIMEOUT)   # A flush right after a cold start can beat init_database
+            log_messages(sent_log)
+        except Exception:
+            log.exception("❌ Message log write error", extra={'messages': len(sent_log)})
+    
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+    last_flush = {
+        'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'duration_ms': duration_ms,
+        'groups': len(buffer_snapshot),
+        'sent': sum(1 for r in results if r['sent']),
+        'failed': len(buffer_snapshot) - sum(1 for r in results if r['sent']),
+        'results': results
+    }
+    last_batch_time = datetime.now()
+    event_broker.publish('flush', last_flush)
+    log.info("⏱️ Flush finished", extra={
+        'latency_ms': duration_ms,
+        'groups': last_flush['groups'],
+        'sent': last_flush['sent'],
+        'failed': last_flush['failed']
+    })
+    return last_flush
+
+def seconds_until_next_flush():
+    """Time until the next scheduled flush (FLUSH_MAX_LATENCY when the buffer is empty)"""
+    if shared_buffer:
+        due, next_in = shared_buffer.find_due(time.time(), unclaimed_only=False)
+    else:
+        with buffer_lock:
+            due, next_in = find_due_groups(time.monotonic())
+    if due:
+        return 0
+    return next_in if next_in is not None else FLUSH_MAX_LATENCY
+
+def process_shared_buffer():
+    """Scheduler for BUFFER_BACKEND=sql - every worker runs one; the group lease picks the flusher"""
+    db_ready.wait()   # buffer tables are created by init_database
+    last_renewal = time.monotonic()
     
     while True:
         try:
-            time.sleep(60)  # Wait 60 seconds
-            print("⏰ Buffer cycle - checking for messages...")
+            # Heartbeat for groups still sending (e.g. sitting out a long 429 wait on one part)
+            if time.monotonic() - last_renewal >= BUFFER_CLAIM_SECONDS / 3:
+                last_renewal = time.monotonic()
+                with buffer_lock:
+                    in_flight = list(groups_in_flight)
+                for gid in in_flight:
+                    renew_group_lease(gid)
             
-            # Take snapshot of buffer and clear it
-            buffer_snapshot = {}
+            buffer_snapshot, next_in = shared_buffer.claim_due()
+            if not buffer_snapshot:
+                timeout = BUFFER_POLL_SECONDS if next_in is None else min(next_in, BUFFER_POLL_SECONDS)
+                with buffer_cond:
+                    buffer_cond.wait(max(timeout, 0.01))
+                continue
             with buffer_lock:
-                if message_buffer:
-                    for gid, msgs in message_buffer.items():
-                        if msgs:
-                            buffer_snapshot[gid] = msgs.copy()
-                    message_buffer.clear()
+                groups_in_flight.update(buffer_snapshot)
+            event_broker.buffer_changed()
             
-            # Send buffered messages
-            if buffer_snapshot:
-                print(f"📤 Sending {len(buffer_snapshot)} group(s)")
-                
-                for idx, (gid, msgs) in enumerate(buffer_snapshot.items()):
-                    # Combine all messages for this group
-                    combined = "\n\n\n".join([m['message'] for m in msgs])
-                    
-                    if send_to_telegram(gid, combined):
-                        # Log the combined message
-                        log_message(combined, gid, msgs[0]['group_name'], 
-                                  ", ".join(set([m['keyword'] for m in msgs])))
-                        print(f"✅ Sent to {msgs[0]['group_name']} ({len(msgs)} messages)")
-                    
-                    # Delay between groups to avoid rate limits
-                    if idx < len(buffer_snapshot) - 1:
-                        time.sleep(5)  # 5 seconds between groups
+            log.debug("📤 Sending batches", extra={'groups': len(buffer_snapshot), 'owner': shared_buffer.owner})
+            threading.Thread(target=flush_buffer_snapshot, args=(buffer_snapshot,), daemon=True).start()
+        
+        except Exception:
+            log.exception("❌ Buffer error")
+            time.sleep(1)
+
+def process_buffer():
+    """Background thread - flushes each group as soon as its flush policy says it is due"""
+    log.info("🔄 Buffer thread starting...", extra={'backend': BUFFER_BACKEND})
+    if shared_buffer:
+        return process_shared_buffer()
+    
+    while True:
+        try:
+            # Sleep until the earliest deadline, or until add_to_buffer / a finished send wakes us
+            with buffer_cond:
+                while True:
+                    due, next_in = find_due_groups(time.monotonic())
+                    if due:
+                        break
+                    buffer_cond.wait(next_in)
                 
-                last_batch_time = datetime.now()
-            else:
-                print("📭 No messages in buffer")
+                buffer_snapshot = {gid: take_batch(gid) for gid in due}
+                groups_in_flight.update(buffer_snapshot)
+            event_broker.buffer_changed()
+            
+            log.debug("📤 Sending batches", extra={'groups': len(buffer_snapshot)})
+            threading.Thread(target=flush_buffer_snapshot, args=(buffer_snapshot,), daemon=True).start()
                 
-        except Exception as e:
-            print(f"❌ Buffer error: {e}")
+        except Exception:
+            log.exception("❌ Buffer error")
+            time.sleep(1)
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 📨 INGESTION
+# ═══════════════════════════════════════════════════════════════════════════
+
+# Async ingest: the webhook only validates and enqueues; workers route and buffer
+WEBHOOK_ASYNC_INGEST = os.environ.get('WEBHOOK_ASYNC_INGEST', 'True').lower() == 'true'
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 1))   # >1 routes faster but can reorder back-to-back alerts
+
+# Duplicate suppression: TradingView retries webhooks, so the same alert can arrive twice within seconds
+ALERT_DEDUP_WINDOW = float(os.environ.get('ALERT_DEDUP_WINDOW', 30))        # Seconds an alert is remembered (0 disables)
+ALERT_DEDUP_MAX_KEYS = int(os.environ.get('ALERT_DEDUP_MAX_KEYS', 10000))   # Oldest keys are evicted past this
+ALERT_DEDUP_HEADER = os.environ.get('ALERT_DEDUP_HEADER', 'Idempotency-Key')   # Optional client-supplied key
+
+ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+CallbackMetric('ingest_queue_depth', 'Alerts accepted by the webhook but not yet routed', lambda: {(): ingest_queue.qsize()})
+
+class DedupWindow:
+    """Thread-safe set of keys seen in the last `window` seconds.
+    
+    Keys are kept in arrival order, so expired keys are always at the front
+    and eviction is O(1) per key; the size is capped at max_keys."""
+
+    def __init__(self, window, max_keys):
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = OrderedDict()   # key -> monotonic time first seen
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def check(self, key):
+        """Record key - returns True if it was already seen inside the window"""
+        now = time.monotonic()
+        with self._lock:
+            while self._seen:
+                if now - next(iter(self._seen.values())) < self.window:
+                    break
+                self._seen.popitem(last=False)
+            if key in self._seen:
+                self.suppressed += 1
+                return True
+            self._seen[key] = now
+            if len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+            return False
 
-# Start buffer thread
-buffer_thread = threading.Thread(target=process_buffer, daemon=True)
-buffer_thread.start()
-print("✅ Buffer thread started")
+    def forget(self, key):
+        """Drop a key again - for alerts that were recorded but could not be accepted"""
+        with self._lock:
+            self._seen.pop(key, None)
+
+alert_dedup = DedupWindow(ALERT_DEDUP_WINDOW, ALERT_DEDUP_MAX_KEYS)
+CallbackMetric('alerts_duplicate_total', 'Alerts dropped as duplicates of a recent alert',
+               lambda: {(): alert_dedup.suppressed}, kind='counter')
+
+def alert_dedup_key(raw_data, idempotency_key=None):
+    """Dedup key of an alert - the idempotency key, else a content hash (None when dedup is off)"""
+    if ALERT_DEDUP_WINDOW <= 0:
+        return None
+    if idempotency_key:
+        return 'key:' + idempotency_key
+    return hashlib.blake2b(str(raw_data).strip().encode('utf-8'), digest_size=16).hexdigest()
+
+def route_alert(raw_data):
+    """Match an alert against GROUPS and buffer it for every matched group - returns group names"""
+    started = time.monotonic()
+    message = str(raw_data)
+    routed_to = []
+    
+    for group_key, group_config, keyword in keyword_router.match(message.upper()):
+        if log_sampled(LOG_KEYWORD_SAMPLE_RATE) and log.isEnabledFor(logging.DEBUG):
+            log.debug("🔑 Keyword matched", extra={'group': group_config['name'], 'keyword': keyword})
+        # Add to buffer instead of sending immediately
+        add_to_buffer(group_config['group_id'], group_config['name'], message, keyword)
+        alerts_routed_total.inc(group_config['name'])
+        routed_to.append(group_config['name'])
+    
+    latency_ms = round((time.monotonic() - started) * 1000, 2)
+    if routed_to:
+        log.info("🔔 Alert buffered", extra={'groups': routed_to, 'latency_ms': latency_ms})
+    else:
+        alerts_unmatched_total.inc()
+        log.warning("⚠️ NO GROUPS MATCHED", extra={'preview': message[:200], 'latency_ms': latency_ms})
+    return routed_to
+
+def ingest_worker():
+    """Background thread - routes alerts queued by webhook_router"""
+    if shared_buffer:
+        db_ready.wait()   # The shared buffer lives in the database; queued alerts wait for its tables
+    while True:
+        raw_data = ingest_queue.get()
+        try:
+            route_alert(raw_data)
+        except Exception:
+            log.exception("❌ Ingest error")
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 💾 DATABASE CONNECTION
 # ═══════════════════════════════════════════════════════════════════════════
 
-def get_db_connection():
-    """Get database connection based on DATABASE_TYPE"""
+# Connection pool settings (override via environment)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))                 # Max open connections
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))        # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))        # Reopen connections older than this
+DB_POOL_PING_AFTER = int(os.environ.get('DB_POOL_PING_AFTER', 30))    # Health-check connections idle longer than this
+DB_POOL_PREFILL = int(os.environ.get('DB_POOL_PREFILL', 2))           # Connections opened by the boot warm-up
+DB_READY_TIMEOUT = float(os.environ.get('DB_READY_TIMEOUT', 30))      # Max seconds a request waits for init_database
+
+def _open_raw_connection():
+    """Open a new raw database connection based on DATABASE_TYPE"""
     if DATABASE_TYPE == 'sqlite':
         import sqlite3
         conn = sqlite3.connect(DATABASE_URL, check_same_thread=False)
@@ -212,100 +1348,822 @@ def get_db_connection():
     else:
         raise ValueError(f"Unsupported database type: {DATABASE_TYPE}")
 
-def init_database():
-    """Initialize database tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if DATABASE_TYPE == 'sqlite':
-        # Users table
-        cursor.execute('''
+class PooledConnection:
+    """Connection proxy - close() hands the connection back to the pool"""
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn, self._created_at)
+
+    def __del__(self):
+        # Safety net for helpers that raise before reaching conn.close()
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class ConnectionPool:
+    """Bounded, thread-safe pool shared by Flask request threads and the buffer thread"""
+
+    def __init__(self, max_size, timeout, recycle, ping_after):
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = []          # [(conn, created_at, last_used)]
+        self._open = 0
+        self._cond = threading.Condition()
+        self._metrics = {
+            'checkouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'waits': 0,
+            'wait_time_ms': 0.0
+        }
+
+    def _is_healthy(self, conn):
+        """Cheap liveness check run before handing out a long-idle connection"""
+        try:
+            if getattr(conn, 'closed', 0):
+                return False
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            if DATABASE_TYPE == 'postgresql':
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._metrics['discarded'] += 1
+            self._cond.notify()
+
+    def connect(self):
+        """Check out a connection, waiting up to `timeout` seconds for a free slot"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise TimeoutError(f"No database connection available after {self.timeout}s (pool size {self.max_size})")
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    conn, created_at, last_used = None, None, None
+                    self._open += 1   # Reserve a slot before connecting outside the lock
+
+            if conn is None:
+                try:
+                    conn = _open_raw_connection()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+                with self._cond:
+                    self._metrics['created'] += 1
+            else:
+                now = time.monotonic()
+                too_old = self.recycle and now - created_at > self.recycle
+                if too_old or (now - last_used > self.ping_after and not self._is_healthy(conn)):
+                    self._discard(conn)
+                    continue
+
+            with self._cond:
+                self._metrics['checkouts'] += 1
+                if waited:
+                    self._metrics['waits'] += 1
+                    self._metrics['wait_time_ms'] += (time.monotonic() - start) * 1000
+            return PooledConnection(self, conn, created_at)
+
+    def release(self, conn, created_at):
+        """Return a connection to the pool, rolling back any unfinished transaction"""
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def prefill(self, count):
+        """Open up to `count` connections ahead of the first request (boot warm-up)"""
+        conns = [self.connect() for _ in range(min(count, self.max_size))]
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        """Pool metrics for /api/stats"""
+        with self._cond:
+            idle = len(self._idle)
+            metrics = dict(self._metrics)
+            metrics.update({
+                'max_size': self.max_size,
+                'open': self._open,
+                'idle': idle,
+                'in_use': self._open - idle
+            })
+        metrics['wait_time_ms'] = round(metrics['wait_time_ms'], 2)
+        return metrics
+
+db_pool = ConnectionPool(DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PING_AFTER)
+CallbackMetric('db_pool_connections', 'Pooled database connections by state',
+               lambda: {(state,): db_pool.stats()[state] for state in ('idle', 'in_use')}, ('state',))
+
+def get_db_connection():
+    """Get a pooled database connection - call conn.close() to return it"""
+    return db_pool.connect()
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🗂️ ROW MAPPING
+# ═══════════════════════════════════════════════════════════════════════════
+# Timestamps are stored as integer epoch seconds on both backends, so expiry math,
+# range filters and sorting happen in SQL. Rows are mapped to the NamedTuples below,
+# and formatting for the API happens only here.
+
+DAY_SECONDS = 86400
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def now_epoch():
+    """Current time as epoch seconds (the storage format)"""
+    return int(time.time())
+
+def to_epoch(value):
+    """Epoch seconds from an epoch, a datetime or a legacy 'YYYY-MM-DD HH:MM:SS' local-time string"""
+    if value is None or isinstance(value, (int, float)):
+        return None if value is None else int(value)
+    if isinstance(value, str):
+        value = datetime.strptime(value.split('.')[0], TIMESTAMP_FORMAT)
+    return int(value.timestamp())   # Naive datetimes are local time
+
+def format_epoch(epoch):
+    """'YYYY-MM-DD HH:MM:SS' in local time for the API"""
+    return None if epoch is None else datetime.fromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+class UserRow(NamedTuple):
+    """users row as returned by get_users_by_group"""
+    user_id: str
+    name: str
+    invited_date: int
+    expiry_date: int
+    days_left: int
+    status: str
+
+    def days_left_at(self, now):
+        return max(0, (self.expiry_date - now) // DAY_SECONDS)
+
+    def to_api(self, now):
+        return {
+            'user_id': self.user_id,
+            'name': self.name,
+            'invited_date': format_epoch(self.invited_date),
+            'expiry_date': format_epoch(self.expiry_date),
+            'days_left': self.days_left_at(now),
+            'status': self.status
+        }
+
+class MessageRow(NamedTuple):
+    """messages row as returned by get_messages_by_group / get_all_messages"""
+    id: int
+    timestamp: int
+    message: str
+    group_id: str
+    group_name: str
+    matched_keywords: str
+
+    def to_api(self):
+        return {
+            'id': self.id,
+            'timestamp': format_epoch(self.timestamp),
+            'message': self.message,
+            'group_id': self.group_id,
+            'group_name': self.group_name,
+            'keywords': self.matched_keywords,
+            'status': 'sent'
+        }
+
+def map_rows(row_type, rows):
+    """Typed rows from cursor.fetchall() (tuples, sqlite3.Row or psycopg2 rows)"""
+    return [row_type(*row) for row in rows]
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🏗️ SCHEMA
+# ═══════════════════════════════════════════════════════════════════════════
+
+SCHEMA = {
+    'sqlite': {
+        'users': '''
             CREATE TABLE IF NOT EXISTS users (
                 user_id TEXT,
                 group_id TEXT,
                 name TEXT,
-                invited_date TEXT,
-                expiry_date TEXT,
+                invited_date INTEGER,
+                expiry_date INTEGER,
                 days_left INTEGER,
                 status TEXT,
+                reminder_days INTEGER,
                 PRIMARY KEY (user_id, group_id)
             )
-        ''')
-        
-        # Messages table
-        cursor.execute('''
+        ''',
+        'messages': '''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
+                timestamp INTEGER,
                 message TEXT,
                 group_id TEXT,
                 group_name TEXT,
                 matched_keywords TEXT
             )
-        ''')
-    
-    elif DATABASE_TYPE == 'postgresql':
-        # Users table
-        cursor.execute('''
+        ''',
+        # Per-alert history (MESSAGE_LOG_PER_ALERT)
+        'alert_log': '''
+            CREATE TABLE IF NOT EXISTS alert_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER,
+                received_at INTEGER,
+                sent_at INTEGER,
+                group_id TEXT,
+                keyword TEXT,
+                message TEXT
+            )
+        ''',
+        # Shared alert buffer (BUFFER_BACKEND=sql) and per-group flush leases
+        'buffer_queue': '''
+            CREATE TABLE IF NOT EXISTS buffer_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id TEXT,
+                group_name TEXT,
+                keyword TEXT,
+                message TEXT,
+                received_at INTEGER,
+                queued_at REAL,
+                urgent INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                not_before REAL DEFAULT 0
+            )
+        ''',
+        'buffer_claims': '''
+            CREATE TABLE IF NOT EXISTS buffer_claims (
+                group_id TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
+            )
+        '''
+    },
+    'postgresql': {
+        'users': '''
             CREATE TABLE IF NOT EXISTS users (
                 user_id VARCHAR(100),
                 group_id VARCHAR(100),
                 name VARCHAR(200),
-                invited_date TIMESTAMP,
-                expiry_date TIMESTAMP,
+                invited_date BIGINT,
+                expiry_date BIGINT,
                 days_left INTEGER,
                 status VARCHAR(20),
+                reminder_days INTEGER,
                 PRIMARY KEY (user_id, group_id)
             )
-        ''')
-        
-        # Messages table
-        cursor.execute('''
+        ''',
+        'messages': '''
             CREATE TABLE IF NOT EXISTS messages (
                 id SERIAL PRIMARY KEY,
-                timestamp TIMESTAMP,
+                timestamp BIGINT,
                 message TEXT,
                 group_id VARCHAR(100),
                 group_name VARCHAR(200),
                 matched_keywords VARCHAR(200)
             )
+        ''',
+        'alert_log': '''
+            CREATE TABLE IF NOT EXISTS alert_log (
+                id SERIAL PRIMARY KEY,
+                message_id INTEGER,
+                received_at BIGINT,
+                sent_at BIGINT,
+                group_id VARCHAR(100),
+                keyword VARCHAR(200),
+                message TEXT
+            )
+        ''',
+        'buffer_queue': '''
+            CREATE TABLE IF NOT EXISTS buffer_queue (
+                id BIGSERIAL PRIMARY KEY,
+                group_id VARCHAR(100),
+                group_name VARCHAR(200),
+                keyword VARCHAR(200),
+                message TEXT,
+                received_at BIGINT,
+                queued_at DOUBLE PRECISION,
+                urgent INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                not_before DOUBLE PRECISION DEFAULT 0
+            )
+        ''',
+        'buffer_claims': '''
+            CREATE TABLE IF NOT EXISTS buffer_claims (
+                group_id VARCHAR(100) PRIMARY KEY,
+                owner VARCHAR(200),
+                expires_at DOUBLE PRECISION
+            )
+        '''
+    }
+}
+
+TIMESTAMP_COLUMNS = {
+    'users': ('invited_date', 'expiry_date'),
+    'messages': ('timestamp',),
+    'alert_log': ('received_at', 'sent_at')
+}
+
+def migrate_timestamps_to_epoch(cursor):
+    """Convert databases created with text (SQLite) or TIMESTAMP (PostgreSQL) dates to epoch seconds"""
+    migrated = []
+    if DATABASE_TYPE == 'sqlite':
+        for table, ts_columns in TIMESTAMP_COLUMNS.items():
+            info = cursor.execute(f'PRAGMA table_info({table})').fetchall()
+            if not any(row[1] in ts_columns and row[2].upper() == 'TEXT' for row in info):
+                continue
+            # SQLite can't change a column type - rebuild the table, converting local-time strings
+            old_columns = {row[1] for row in info}
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_text_dates')
+            cursor.execute(SCHEMA['sqlite'][table])
+            new_columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()
+                           if row[1] in old_columns]
+            select = [f"CAST(strftime('%s', {c}, 'utc') AS INTEGER)" if c in ts_columns else c for c in new_columns]
+            cursor.execute(f'''
+                INSERT INTO {table} ({', '.join(new_columns)})
+                SELECT {', '.join(select)} FROM {table}_text_dates
+            ''')
+            cursor.execute(f'DROP TABLE {table}_text_dates')
+            migrated.append(table)
+    else:
+        # Naive TIMESTAMPs were written in the app's local time
+        utc_offset = int(datetime.now().astimezone().utcoffset().total_seconds())
+        for table, ts_columns in TIMESTAMP_COLUMNS.items():
+            for column in ts_columns:
+                cursor.execute('''
+                    SELECT data_type FROM information_schema.columns
+                    WHERE table_name = %s AND column_name = %s
+                ''', (table, column))
+                row = cursor.fetchone()
+                if row and row[0].startswith('timestamp'):
+                    cursor.execute(f'''
+                        ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT
+                        USING (EXTRACT(EPOCH FROM {column})::BIGINT - {utc_offset})
+                    ''')
+                    migrated.append(f'{table}.{column}')
+    if migrated:
+        log.info("🏗️ Migrated timestamps to epoch seconds", extra={'migrated': migrated})
+
+fts_enabled = False   # SQLite: messages_fts exists (set by init_database; PostgreSQL always has its GIN index)
+
+def init_message_search(cursor):
+    """Full-text index on messages.message - FTS5 on SQLite, a generated tsvector + GIN index on PostgreSQL"""
+    global fts_enabled
+    if DATABASE_TYPE == 'sqlite':
+        import sqlite3
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone():
+            fts_enabled = True
+            return
+        try:
+            # External content table: the index stores tokens only, text stays in messages
+            cursor.execute('''
+                CREATE VIRTUAL TABLE messages_fts USING fts5(
+                    message, content='messages', content_rowid='id', tokenize='unicode61'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            log.warning("⚠️ SQLite FTS5 unavailable, message search falls back to LIKE scans", extra={'error': str(e)})
+            return
+        cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")   # Index existing rows
+        fts_enabled = True
+        log.info("🔎 Built message search index")
+    else:
+        cursor.execute('''
+            ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(message, ''))) STORED
         ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search_vector)')
+        fts_enabled = True
+
+def init_database():
+    """Initialize database tables (and migrate older schemas)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if DATABASE_TYPE == 'sqlite':
+        cursor.execute('BEGIN')   # Run table rebuilds in one transaction
+    
+    for create_sql in SCHEMA[DATABASE_TYPE].values():
+        cursor.execute(create_sql)
+    
+    # Smallest pre-expiry reminder already sent (NULL = none) - added to existing databases too
+    if DATABASE_TYPE == 'sqlite':
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(users)').fetchall()]
+        if 'reminder_days' not in columns:
+            cursor.execute('ALTER TABLE users ADD COLUMN reminder_days INTEGER')
+    else:
+        cursor.execute('ALTER TABLE users ADD COLUMN IF NOT EXISTS reminder_days INTEGER')
+    
+    migrate_timestamps_to_epoch(cursor)
+    
+    # Secondary indexes (same syntax on both backends)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_group_id ON messages (group_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_group_invited ON users (group_id, invited_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_log_group_id ON alert_log (group_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_status_expiry ON users (status, expiry_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_buffer_queue_group_id ON buffer_queue (group_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_alert_log_message_id ON alert_log (message_id)')   # Retention deletes by message id
+    
+    init_message_search(cursor)
     
     conn.commit()
     conn.close()
-    print("✅ Database initialized")
+    db_ready.set()
+    log.info("✅ Database initialized")
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🧠 TELEGRAM CACHE
+# ═══════════════════════════════════════════════════════════════════════════
+
+MEMBERSHIP_CACHE_TTL = int(os.environ.get('MEMBERSHIP_CACHE_TTL', 300))          # Seconds a getChatMember answer stays fresh
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', 20000))
+MEMBERSHIP_LOOKUP_WORKERS = int(os.environ.get('MEMBERSHIP_LOOKUP_WORKERS', 10))  # Concurrent getChatMember calls
+# Serve expired entries immediately and refresh them in the background (also ?stale=1)
+MEMBERSHIP_STALE_WHILE_REVALIDATE = os.environ.get('MEMBERSHIP_STALE_WHILE_REVALIDATE', 'False').lower() == 'true'
+
+class TTLCache:
+    """Thread-safe TTL cache, evicting least recently used entries past max_size"""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()   # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, allow_stale=False):
+        """Return (found, value, fresh) - expired entries only count as found with allow_stale"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None, False
+            value, expires_at = entry
+            fresh = time.monotonic() < expires_at
+            if not fresh and not allow_stale:
+                self.misses += 1
+                return False, None, False
+            self.hits += 1
+            self._data.move_to_end(key)
+            return True, value, fresh
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'max_size': self.max_size, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
+
+def memoize(cache, should_cache=lambda value: True):
+    """Cache a Telegram read call in `cache`, keyed by its (stringified) arguments.
+    
+    The wrapped function gains .refresh(*args) (bypass + repopulate) and .invalidate(*args)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            key = tuple(str(a) for a in args)
+            found, value, _ = cache.get(key)
+            if found:
+                return value
+            value = fn(*args)
+            if should_cache(value):
+                cache.set(key, value)
+            return value
+        
+        def refresh(*args):
+            value = fn(*args)
+            if should_cache(value):
+                cache.set(tuple(str(a) for a in args), value)
+            return value
+        
+        wrapper.refresh = refresh
+        wrapper.invalidate = lambda *args: cache.invalidate(tuple(str(a) for a in args) if args else None)
+        return wrapper
+    return decorator
+
+USER_INFO_CACHE_TTL = int(os.environ.get('USER_INFO_CACHE_TTL', 3600))   # getChat (user display names)
+ADMINS_CACHE_TTL = int(os.environ.get('ADMINS_CACHE_TTL', 600))         # getChatAdministrators
+ADMINS_REFRESH_INTERVAL = int(os.environ.get('ADMINS_REFRESH_INTERVAL', 300))   # 0 disables the refresher
+
+membership_cache = TTLCache(MEMBERSHIP_CACHE_TTL, MEMBERSHIP_CACHE_SIZE)
+user_info_cache = TTLCache(USER_INFO_CACHE_TTL, 5000)
+admins_cache = TTLCache(ADMINS_CACHE_TTL, 500)
+telegram_caches = {
+    'membership': membership_cache,
+    'user_info': user_info_cache,
+    'admins': admins_cache
+}
+CallbackMetric('telegram_cache_hits_total', 'Telegram read cache hits',
+               lambda: {(name,): cache.hits for name, cache in telegram_caches.items()}, ('cache',), kind='counter')
+CallbackMetric('telegram_cache_misses_total', 'Telegram read cache misses',
+               lambda: {(name,): cache.misses for name, cache in telegram_caches.items()}, ('cache',), kind='counter')
+membership_executor = ThreadPoolExecutor(max_workers=MEMBERSHIP_LOOKUP_WORKERS, thread_name_prefix='membership')
+membership_refreshing = set()   # Keys with a background refresh in flight
+membership_refreshing_lock = threading.Lock()
+
+def lookup_membership(group_id, user_id):
+    """getChatMember through the cache; failed lookups are not cached"""
+    joined = check_user_in_group(group_id, user_id)
+    if joined is not None:
+        membership_cache.set((str(group_id), str(user_id)), joined)
+    return joined
+
+def refresh_membership_async(group_id, keys):
+    """Queue background refreshes, skipping keys already being refreshed"""
+    with membership_refreshing_lock:
+        keys = [k for k in keys if k not in membership_refreshing]
+        membership_refreshing.update(keys)
+    
+    def refresh(key):
+        try:
+            lookup_membership(group_id, key[1])
+        finally:
+            with membership_refreshing_lock:
+                membership_refreshing.discard(key)
+    
+    for key in keys:
+        membership_executor.submit(refresh, key)
+
+def get_memberships(group_id, user_ids, stale_ok=False):
+    """Return {user_id: joined} for many users - cached, misses looked up concurrently.
+    
+    With stale_ok, nothing blocks: expired entries are returned as-is and unknown
+    users as None while both are refreshed in the background."""
+    result = {}
+    misses = []
+    stale = []
+    
+    for user_id in user_ids:
+        key = (str(group_id), str(user_id))
+        found, joined, fresh = membership_cache.get(key, allow_stale=stale_ok)
+        if found:
+            result[user_id] = joined
+            if not fresh:
+                stale.append(key)
+        else:
+            misses.append(user_id)
+    
+    if stale_ok:
+        for user_id in misses:
+            result[user_id] = None
+        refresh_membership_async(group_id, stale + [(str(group_id), str(u)) for u in misses])
+        return result
+    
+    if misses:
+        lookups = membership_executor.map(lambda u: lookup_membership(group_id, u), misses)
+        for user_id, joined in zip(misses, lookups):
+            result[user_id] = joined
+    
+    return result
+
+def invalidate_membership(group_id, user_id):
+    """Forget a cached membership after the user was added or removed"""
+    membership_cache.invalidate((str(group_id), str(user_id)))
+
+def refresh_group_admins():
+    """Background thread - keeps admins of every enabled group warm in admins_cache"""
+    while True:
+        for config in GROUPS.values():
+            if config['enabled']:
+                try:
+                    get_group_admins.refresh(config['group_id'])
+                except Exception:
+                    log.exception("❌ Admin refresh error", extra={'group': config['name']})
+        time.sleep(ADMINS_REFRESH_INTERVAL)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 📱 TELEGRAM FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════════════
 
+# Shared HTTP session - keeps connections to the Bot API alive between calls
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+TELEGRAM_CONNECT_TIMEOUT = float(os.environ.get('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.environ.get('TELEGRAM_READ_TIMEOUT', 10))
+TELEGRAM_TIMEOUT = (TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT)
+TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', 20))   # Keep-alive connections kept open
+
+def create_telegram_session():
+    """requests.Session with a sized keep-alive pool and backoff retries"""
+    import requests   # Deferred: ~60ms of imports that a cold-started webhook doesn't need
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    class InstrumentedSession(requests.Session):
+        """requests.Session that records latency and status code per Bot API method"""
+        def request(self, method, url, *args, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            started = time.perf_counter()
+            code = 'exception'
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                code = str(response.status_code)
+                return response
+            finally:
+                telegram_request_seconds.observe(time.perf_counter() - started, api_method)
+                telegram_responses_total.inc(api_method, code)
+    
+    # Retry connection failures and gateway errors only - never replay a request
+    # Telegram may already have processed (read errors), and leave 429 to the rate limiter
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=3,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TELEGRAM_POOL_SIZE, max_retries=retry)
+    # urllib3 warns on each retry with the request path, which carries the bot token
+    logging.getLogger('urllib3.connectionpool').setLevel(logging.ERROR)
+    
+    session = InstrumentedSession() if METRICS_ENABLED else requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+telegram_session = None   # Created on first use (or by the boot warm-up)
+telegram_session_lock = threading.Lock()
+
+def get_telegram_session():
+    """The shared Bot API session"""
+    global telegram_session
+    if telegram_session is None:
+        with telegram_session_lock:
+            if telegram_session is None:
+                telegram_session = create_telegram_session()
+    return telegram_session
+
+def telegram_url(method):
+    """Bot API URL for a method, e.g. telegram_url('sendMessage')"""
+    return f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/{method}"
+
+def telegram_error(e, response=None):
+    """Log fields for a failed Bot API call - never str(e), whose URL carries the bot token"""
+    fields = {'error': type(e).__name__}
+    if response is not None:
+        fields['status'] = response.status_code
+        try:
+            fields['description'] = response.json().get('description')
+        except Exception:
+            pass
+    return fields
+
+# Telegram rate limits: ~30 msg/s overall, 20 msg/min per group, ~1 msg/s per private chat
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30))          # messages/second
+TELEGRAM_GROUP_RATE = float(os.environ.get('TELEGRAM_GROUP_RATE', 20)) / 60       # messages/second per group
+TELEGRAM_GROUP_BURST = int(os.environ.get('TELEGRAM_GROUP_BURST', 5))
+TELEGRAM_PRIVATE_RATE = float(os.environ.get('TELEGRAM_PRIVATE_RATE', 1))         # messages/second per user
+TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', 3))             # Retries after a 429
+TELEGRAM_ADMIN_RATE = float(os.environ.get('TELEGRAM_ADMIN_RATE', 20))            # invite/ban calls/second
+BULK_TELEGRAM_WORKERS = int(os.environ.get('BULK_TELEGRAM_WORKERS', 8))           # Parallel Bot API calls per bulk request
+
+class TokenBucket:
+    """Blocking token bucket - acquire() waits until a token is free"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """Block the bucket for `seconds` (Telegram 429 retry_after)"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            # One token is ready the moment the block lifts; refill resumes from there
+            self.tokens = 1
+            self.updated = self.blocked_until
+
+global_send_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+admin_call_bucket = TokenBucket(TELEGRAM_ADMIN_RATE, TELEGRAM_ADMIN_RATE)   # createChatInviteLink / banChatMember
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_TELEGRAM_WORKERS, thread_name_prefix='bulk')
+chat_send_buckets = {}
+chat_send_buckets_lock = threading.Lock()
+
+def get_chat_bucket(chat_id):
+    """Per-chat bucket - groups (negative ids) and private chats have different limits"""
+    key = str(chat_id)
+    with chat_send_buckets_lock:
+        bucket = chat_send_buckets.get(key)
+        if bucket is None:
+            if key.startswith('-'):
+                bucket = TokenBucket(TELEGRAM_GROUP_RATE, TELEGRAM_GROUP_BURST)
+            else:
+                bucket = TokenBucket(TELEGRAM_PRIVATE_RATE, 1)
+            chat_send_buckets[key] = bucket
+        return bucket
+
 def send_to_telegram(group_id, text):
-    """Send message to Telegram group"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    """Send message to Telegram group (rate limited, retries on 429)"""
+    url = telegram_url('sendMessage')
     payload = {'chat_id': group_id, 'text': text}
+    chat_bucket = get_chat_bucket(group_id)
     
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        return True
-    except Exception as e:
-        print(f"❌ Failed to send to {group_id}: {e}")
-        # Show detailed error response from Telegram
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        chat_bucket.acquire()
+        global_send_bucket.acquire()
+        response = None
         try:
-            error_details = response.json()
-            print(f"   Telegram API Response: {error_details}")
-        except:
-            pass
-        return False
+            response = get_telegram_session().post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
+            if response.status_code == 429 and attempt < TELEGRAM_MAX_RETRIES:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+                log.warning("⏳ Rate limited", extra={'group_id': group_id, 'retry_after': retry_after, 'attempt': attempt})
+                chat_bucket.penalize(retry_after)
+                continue
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            log.error("❌ Failed to send", extra={'group_id': group_id, **telegram_error(e, response)})
+            return False
+    return False
 
 def create_invite_link(group_id, expire_days=30):
     """Create invite link for group"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/createChatInviteLink"
+    url = telegram_url('createChatInviteLink')
     expire_date = int(time.time()) + (expire_days * 86400)
     payload = {'chat_id': group_id, 'expire_date': expire_date, 'member_limit': 1}
+    response = None
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        admin_call_bucket.acquire()
+        response = get_telegram_session().post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
         response.raise_for_status()
         data = response.json()
         
@@ -313,47 +2171,53 @@ def create_invite_link(group_id, expire_days=30):
             return data['result']['invite_link']
         return None
     except Exception as e:
-        print(f"❌ Failed to create invite link: {e}")
+        log.error("❌ Failed to create invite link", extra={'group_id': group_id, **telegram_error(e, response)})
         return None
 
 def check_user_in_group(group_id, user_id):
-    """Check if user is in group"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getChatMember"
+    """Check if user is in group - None if Telegram couldn't answer (not cached)"""
+    url = telegram_url('getChatMember')
     
     try:
-        response = requests.post(url, json={'chat_id': group_id, 'user_id': user_id}, timeout=10)
+        response = get_telegram_session().post(url, json={'chat_id': group_id, 'user_id': user_id}, timeout=TELEGRAM_TIMEOUT)
         data = response.json()
         
         if data.get('ok'):
             status = data['result']['status']
             return status in ['member', 'administrator', 'creator']
-        return False
+        if response.status_code == 400:
+            return False   # e.g. "user not found" - a real answer
+        return None
     except:
-        return False
+        return None
 
 def ban_user_from_group(group_id, user_id):
     """Remove user from group"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/banChatMember"
+    url = telegram_url('banChatMember')
+    response = None
     
     try:
-        response = requests.post(url, json={'chat_id': group_id, 'user_id': user_id}, timeout=10)
+        admin_call_bucket.acquire()
+        response = get_telegram_session().post(url, json={'chat_id': group_id, 'user_id': user_id}, timeout=TELEGRAM_TIMEOUT)
         response.raise_for_status()
         
         # Unban so they can be re-invited later
-        unban_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/unbanChatMember"
-        requests.post(unban_url, json={'chat_id': group_id, 'user_id': user_id, 'only_if_banned': True})
+        admin_call_bucket.acquire()
+        unban_url = telegram_url('unbanChatMember')
+        get_telegram_session().post(unban_url, json={'chat_id': group_id, 'user_id': user_id, 'only_if_banned': True}, timeout=TELEGRAM_TIMEOUT)
         
         return True
     except Exception as e:
-        print(f"❌ Failed to ban user: {e}")
+        log.error("❌ Failed to ban user", extra={'group_id': group_id, 'user_id': user_id, **telegram_error(e, response)})
         return False
 
+@memoize(user_info_cache, should_cache=lambda name: name != "Unknown")
 def get_user_info(user_id):
     """Get user info from Telegram"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getChat"
+    url = telegram_url('getChat')
     
     try:
-        response = requests.post(url, json={'chat_id': user_id}, timeout=10)
+        response = get_telegram_session().post(url, json={'chat_id': user_id}, timeout=TELEGRAM_TIMEOUT)
         data = response.json()
         
         if data.get('ok'):
@@ -372,12 +2236,14 @@ def get_user_info(user_id):
     except:
         return "Unknown"
 
+@memoize(admins_cache, should_cache=lambda admins: bool(admins))
 def get_group_admins(group_id):
     """Get all admins from Telegram group"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getChatAdministrators"
+    url = telegram_url('getChatAdministrators')
+    response = None
     
     try:
-        response = requests.get(url, params={'chat_id': group_id}, timeout=10)
+        response = get_telegram_session().get(url, params={'chat_id': group_id}, timeout=TELEGRAM_TIMEOUT)
         result = response.json()
         
         admins = []
@@ -394,31 +2260,29 @@ def get_group_admins(group_id):
         
         return admins
     except Exception as e:
-        print(f"❌ Failed to get admins: {e}")
+        log.error("❌ Failed to get admins", extra={'group_id': group_id, **telegram_error(e, response)})
         return []
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 🗃️ DATABASE FUNCTIONS
 # ═══════════════════════════════════════════════════════════════════════════
 
+@db_timed
 def add_user(group_id, user_id, days):
     """Add user to group"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     name = get_user_info(user_id)
-    invited_date = datetime.now()
-    expiry_date = datetime.now() + timedelta(days=days)
+    invited_date = now_epoch()
+    expiry_date = invited_date + days * DAY_SECONDS
     
     if DATABASE_TYPE == 'sqlite':
-        invited_date_str = invited_date.strftime('%Y-%m-%d %H:%M:%S')
-        expiry_date_str = expiry_date.strftime('%Y-%m-%d %H:%M:%S')
-        
         cursor.execute('''
             INSERT OR REPLACE INTO users 
             (user_id, group_id, name, invited_date, expiry_date, days_left, status)
             VALUES (?, ?, ?, ?, ?, ?, 'active')
-        ''', (user_id, group_id, name, invited_date_str, expiry_date_str, days))
+        ''', (user_id, group_id, name, invited_date, expiry_date, days))
         
     elif DATABASE_TYPE == 'postgresql':
         cursor.execute('''
@@ -427,227 +2291,891 @@ def add_user(group_id, user_id, days):
             VALUES (%s, %s, %s, %s, %s, %s, 'active')
             ON CONFLICT (user_id, group_id) DO UPDATE SET
             name=EXCLUDED.name, invited_date=EXCLUDED.invited_date, 
-            expiry_date=EXCLUDED.expiry_date, days_left=EXCLUDED.days_left, status='active'
+            expiry_date=EXCLUDED.expiry_date, days_left=EXCLUDED.days_left, status='active',
+            reminder_days=NULL
         ''', (user_id, group_id, name, invited_date, expiry_date, days))
     
-    conn.commit()
-    conn.close()
+    conn.commit()
+    conn.close()
+    stats_counters.user_upserted(group_id, user_id, 'active')
+
+@db_timed
+def get_users_by_group(group_id, min_expiry=None):
+    """Get users for a specific group as UserRows (min_expiry: only rows expiring at/after it)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    params = [group_id]
+    expiry_filter = ''
+    if min_expiry is not None:
+        expiry_filter = f"AND status = 'active' AND expiry_date >= {placeholder}"
+        params.append(min_expiry)
+    cursor.execute(f'''
+        SELECT user_id, name, invited_date, expiry_date, days_left, status
+        FROM users
+        WHERE group_id = {placeholder} {expiry_filter}
+        ORDER BY invited_date DESC
+    ''', params)
+    
+    users = map_rows(UserRow, cursor.fetchall())
+    conn.close()
+    return users
+
+@db_timed
+def update_user_expiry(group_id, user_id, additional_days):
+    """Extend user expiry - one atomic UPDATE, returns the new expiry (None if the user doesn't exist).
+    A swept ('expired') user whose new expiry is in the future becomes active again."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    shift = additional_days * DAY_SECONDS
+    cursor.execute(f'''
+        UPDATE users
+        SET expiry_date = expiry_date + {placeholder}, reminder_days = NULL,
+            status = CASE WHEN expiry_date + {placeholder} > {placeholder} THEN 'active' ELSE status END
+        WHERE group_id = {placeholder} AND user_id = {placeholder}
+        RETURNING expiry_date, status
+    ''', (shift, shift, now_epoch(), group_id, user_id))
+    
+    result = cursor.fetchall()
+    conn.commit()
+    conn.close()
+    if not result:
+        return None
+    stats_counters.user_upserted(group_id, user_id, result[0][1])
+    return result[0][0]
+
+@db_timed
+def reduce_user_expiry(group_id, user_id, reduce_days):
+    """Reduce user expiry (but not below current date) - Returns error if would go negative"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    shift = reduce_days * DAY_SECONDS
+    now = now_epoch()
+    # The "would go negative" guard lives in the WHERE clause, so concurrent changes can't race it
+    cursor.execute(f'''
+        UPDATE users
+        SET expiry_date = expiry_date - {placeholder}
+        WHERE group_id = {placeholder} AND user_id = {placeholder} AND expiry_date - {placeholder} >= {placeholder}
+        RETURNING expiry_date
+    ''', (shift, group_id, user_id, shift, now))
+    
+    result = cursor.fetchall()
+    conn.commit()
+    if result:
+        conn.close()
+        return {'success': True}
+    
+    # Nothing updated - look up why (error path only)
+    cursor.execute(f'''
+        SELECT expiry_date FROM users
+        WHERE group_id = {placeholder} AND user_id = {placeholder}
+    ''', (group_id, user_id))
+    row = cursor.fetchone()
+    conn.close()
+    
+    if row is None:
+        return {'error': 'User not found'}
+    days_left = max(0, (row[0] - now) // DAY_SECONDS)
+    return {'error': f'Cannot reduce by {reduce_days} days. User only has {days_left} days left. Maximum you can reduce is {days_left} days.'}
+
+@db_timed
+def remove_user(group_id, user_id):
+    """Remove user from database"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    cursor.execute(f'DELETE FROM users WHERE group_id = {placeholder} AND user_id = {placeholder}', (group_id, user_id))
+    
+    conn.commit()
+    conn.close()
+    stats_counters.user_removed(group_id, user_id)
+
+BULK_MAX_OPERATIONS = int(os.environ.get('BULK_MAX_OPERATIONS', 1000))
+BULK_LOOKUP_CHUNK = 400   # (group_id, user_id) pairs per lookup - stays under SQLite's bound-variable limit
+
+def select_user_expiries(cursor, keys):
+    """{(group_id, user_id): expiry epoch} for the keys that exist - rows are locked on PostgreSQL"""
+    keys = list(keys)
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    lock = '' if DATABASE_TYPE == 'sqlite' else ' FOR UPDATE'
+    found = {}
+    for i in range(0, len(keys), BULK_LOOKUP_CHUNK):
+        chunk = keys[i:i + BULK_LOOKUP_CHUNK]
+        pairs = ', '.join([f'({placeholder}, {placeholder})'] * len(chunk))
+        cursor.execute(f'''
+            SELECT group_id, user_id, expiry_date FROM users
+            WHERE (group_id, user_id) IN (VALUES {pairs}){lock}
+        ''', [value for key in chunk for value in key])
+        for group_id, user_id, expiry_date in cursor.fetchall():
+            found[(group_id, user_id)] = expiry_date
+    return found
+
+@db_timed
+def apply_user_operations(ops):
+    """Apply many add/extend/reduce/remove operations in one transaction.
+    
+    ops are dicts with action, group_id, user_id, days (plus name for add). Returns one
+    {'success': True} or {'error': ...} per op, in order - failed ops don't abort the others."""
+    now = now_epoch()
+    results = [None] * len(ops)
+    adds, shifts, removes = [], [], []   # shifts: (index, group_id, user_id, signed seconds)
+    reactivated = set()   # Extended users whose final expiry is in the future
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if DATABASE_TYPE == 'sqlite':
+            cursor.execute('BEGIN IMMEDIATE')   # Take the write lock before reading, so the checks below hold
+        
+        # Running expiry per user, so each op is checked against the ops before it in this request
+        expiry = select_user_expiries(cursor, {(op['group_id'], op['user_id']) for op in ops if op['action'] != 'add'})
+        for i, op in enumerate(ops):
+            key = (op['group_id'], op['user_id'])
+            if op['action'] == 'add':
+                # The add replaces the whole row, so earlier shifts/removes of this user are moot
+                shifts = [s for s in shifts if (s[1], s[2]) != key]
+                removes = [r for r in removes if (r[1], r[2]) != key]
+                adds = [a for a in adds if (a[1], a[0]) != key]
+                adds.append((op['user_id'], op['group_id'], op['name'], now, now + op['days'] * DAY_SECONDS, op['days']))
+                expiry[key] = now + op['days'] * DAY_SECONDS
+            elif key not in expiry:
+                results[i] = {'error': 'User not found'}
+            elif op['action'] == 'extend':
+                shifts.append((i, op['group_id'], op['user_id'], op['days'] * DAY_SECONDS))
+                expiry[key] += op['days'] * DAY_SECONDS
+                if expiry[key] > now:
+                    reactivated.add(key)
+            elif op['action'] == 'reduce':
+                if expiry[key] - op['days'] * DAY_SECONDS < now:
+                    days_left = max(0, (expiry[key] - now) // DAY_SECONDS)
+                    results[i] = {'error': f"Cannot reduce by {op['days']} days. User only has {days_left} days left. Maximum you can reduce is {days_left} days."}
+                else:
+                    shifts.append((i, op['group_id'], op['user_id'], -op['days'] * DAY_SECONDS))
+                    expiry[key] -= op['days'] * DAY_SECONDS
+            elif op['action'] == 'remove':
+                removes.append((i, op['group_id'], op['user_id']))
+                del expiry[key]
+                reactivated.discard(key)
+        
+        # One net shift per user - an UPDATE ... FROM (VALUES) applies only one row per target
+        net = {}   # (group_id, user_id) -> (signed seconds, extended)
+        for _, g, u, d in shifts:
+            total, extended = net.get((g, u), (0, False))
+            net[(g, u)] = (total + d, extended or d > 0)
+        
+        if DATABASE_TYPE == 'sqlite':
+            cursor.executemany('''
+                INSERT OR REPLACE INTO users
+                (user_id, group_id, name, invited_date, expiry_date, days_left, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'active')
+            ''', adds)
+            # Date arithmetic in SQL; the guard re-checks reductions against the clock
+            cursor.executemany('''
+                UPDATE users SET expiry_date = expiry_date + ?,
+                    reminder_days = CASE WHEN ? THEN NULL ELSE reminder_days END,
+                    status = CASE WHEN expiry_date + ? > ? THEN 'active' ELSE status END
+                WHERE group_id = ? AND user_id = ? AND (? >= 0 OR expiry_date + ? >= ?)
+            ''', [(d, int(ext), d, now, g, u, d, d, now) for (g, u), (d, ext) in net.items()])
+            cursor.executemany('DELETE FROM users WHERE group_id = ? AND user_id = ?',
+                               [(g, u) for _, g, u in removes])
+        elif DATABASE_TYPE == 'postgresql':
+            import psycopg2.extras
+            if adds:
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO users
+                    (user_id, group_id, name, invited_date, expiry_date, days_left, status)
+                    VALUES %s
+                    ON CONFLICT (user_id, group_id) DO UPDATE SET
+                    name=EXCLUDED.name, invited_date=EXCLUDED.invited_date,
+                    expiry_date=EXCLUDED.expiry_date, days_left=EXCLUDED.days_left, status='active',
+                    reminder_days=NULL
+                ''', adds, template="(%s, %s, %s, %s, %s, %s, 'active')")
+            if net:
+                # execute_values takes a single %s, so the (integer) clock is inlined
+                psycopg2.extras.execute_values(cursor, f'''
+                    UPDATE users u SET expiry_date = u.expiry_date + v.shift,
+                        reminder_days = CASE WHEN v.extended THEN NULL ELSE u.reminder_days END,
+                        status = CASE WHEN u.expiry_date + v.shift > {int(now)} THEN 'active' ELSE u.status END
+                    FROM (VALUES %s) AS v (group_id, user_id, shift, extended)
+                    WHERE u.group_id = v.group_id AND u.user_id = v.user_id
+                      AND (v.shift >= 0 OR u.expiry_date + v.shift >= {int(now)})
+                ''', [(g, u, d, ext) for (g, u), (d, ext) in net.items()])
+            if removes:
+                psycopg2.extras.execute_values(cursor, '''
+                    DELETE FROM users u USING (VALUES %s) AS v (group_id, user_id)
+                    WHERE u.group_id = v.group_id AND u.user_id = v.user_id
+                ''', [(g, u) for _, g, u in removes])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    for i, op in enumerate(ops):
+        if results[i] is None:
+            results[i] = {'success': True}
+            if op['action'] == 'add':
+                stats_counters.user_upserted(op['group_id'], op['user_id'], 'active')
+            elif op['action'] == 'extend' and (op['group_id'], op['user_id']) in reactivated:
+                stats_counters.user_upserted(op['group_id'], op['user_id'], 'active')   # Renewed after a sweep
+            elif op['action'] == 'remove':
+                stats_counters.user_removed(op['group_id'], op['user_id'])
+    return results
+
+@db_timed
+def log_messages(records):
+    """Log sent messages in one transaction - records are
+    (message, group_id, group_name, matched_keywords, alerts) with alerts [(keyword, text, received_at)]"""
+    if not records:
+        return []
+    timestamp = now_epoch()
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if DATABASE_TYPE == 'sqlite':
+            cursor.executemany('''
+                INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(timestamp, message, gid, name, keywords) for message, gid, name, keywords, _ in records])
+            # The transaction holds SQLite's write lock, so the new ids are consecutive
+            last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+            message_ids = list(range(last_id - len(records) + 1, last_id + 1))
+            if fts_enabled:
+                cursor.executemany('INSERT INTO messages_fts (rowid, message) VALUES (?, ?)',
+                                   [(message_id, record[0]) for message_id, record in zip(message_ids, records)])
+            alert_rows = [(message_id, to_epoch(received_at), timestamp, record[1], keyword, text)
+                          for message_id, record in zip(message_ids, records)
+                          for keyword, text, received_at in record[4]]
+            if alert_rows:
+                cursor.executemany('''
+                    INSERT INTO alert_log (message_id, received_at, sent_at, group_id, keyword, message)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', alert_rows)
+        elif DATABASE_TYPE == 'postgresql':
+            import psycopg2.extras
+            # One multi-row INSERT ... RETURNING instead of a round trip per message
+            # search_vector is a generated column, so the search index is updated by the insert itself
+            message_ids = [row[0] for row in psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords)
+                VALUES %s RETURNING id
+            ''', [(timestamp, message, gid, name, keywords) for message, gid, name, keywords, _ in records],
+                fetch=True)]
+            alert_rows = [(message_id, to_epoch(received_at), timestamp, record[1], keyword, text)
+                          for message_id, record in zip(message_ids, records)
+                          for keyword, text, received_at in record[4]]
+            if alert_rows:
+                psycopg2.extras.execute_values(cursor, '''
+                    INSERT INTO alert_log (message_id, received_at, sent_at, group_id, keyword, message)
+                    VALUES %s
+                ''', alert_rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    for message_id, (message, group_id, group_name, matched_keywords, _) in zip(message_ids, records):
+        stats_counters.message_logged(group_id)
+        event_broker.publish('message', MessageRow(message_id, timestamp, message, group_id,
+                                                   group_name, matched_keywords).to_api())
+    return message_ids
+
+def log_message(message, group_id, group_name, matched_keywords):
+    """Log one message sent to group"""
+    return log_messages([(message, group_id, group_name, matched_keywords, [])])[0]
 
-def get_users_by_group(group_id):
-    """Get all users for a specific group"""
+def keyset_page(before_id, after_id, placeholder):
+    """WHERE fragment, params and ORDER BY for id-cursor pagination (no OFFSET scans).
+    
+    before_id pages back into older rows; after_id fetches rows newer than the cursor."""
+    if after_id is not None:
+        return f'id > {placeholder}', [after_id], 'ASC'
+    if before_id is not None:
+        return f'id < {placeholder}', [before_id], 'DESC'
+    return '1 = 1', [], 'DESC'
+
+@db_timed
+def get_messages_by_group(group_id, limit=50, before_id=None, after_id=None):
+    """MessageRows for a specific group (newest first, keyset-paginated by id)"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    cursor_sql, cursor_params, order = keyset_page(before_id, after_id, placeholder)
+    # Served by idx_messages_group_id (group_id, id)
     cursor.execute(f'''
-        SELECT user_id, name, invited_date, expiry_date, days_left, status
-        FROM users
-        WHERE group_id = {placeholder}
-        ORDER BY invited_date DESC
-    ''', (group_id,))
+        SELECT id, timestamp, message, group_id, group_name, matched_keywords
+        FROM messages
+        WHERE group_id = {placeholder} AND {cursor_sql}
+        ORDER BY id {order}
+        LIMIT {placeholder}
+    ''', [group_id] + cursor_params + [limit])
     
-    users = cursor.fetchall()
+    messages = map_rows(MessageRow, cursor.fetchall())
     conn.close()
-    return users
+    return messages if order == 'DESC' else messages[::-1]
 
-def update_user_expiry(group_id, user_id, additional_days):
-    """Extend user expiry"""
+@db_timed
+def get_all_messages(limit=100, before_id=None, after_id=None):
+    """MessageRows across all groups (newest first, keyset-paginated by id)"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    cursor_sql, cursor_params, order = keyset_page(before_id, after_id, placeholder)
     cursor.execute(f'''
-        SELECT expiry_date FROM users
-        WHERE group_id = {placeholder} AND user_id = {placeholder}
-    ''', (group_id, user_id))
-    
-    result = cursor.fetchone()
-    if result:
-        if DATABASE_TYPE == 'sqlite':
-            current_expiry = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-            new_expiry = current_expiry + timedelta(days=additional_days)
-            new_expiry_str = new_expiry.strftime('%Y-%m-%d %H:%M:%S')
-        else:  # postgresql
-            # Parse the result - it might be datetime or string
-            if isinstance(result[0], str):
-                # It's a string, parse it
-                try:
-                    current_expiry = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    # Try with microseconds
-                    current_expiry = datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S')
-            else:
-                # It's already a datetime object
-                current_expiry = result[0]
-                # Remove timezone for comparison if present
-                if hasattr(current_expiry, 'tzinfo') and current_expiry.tzinfo is not None:
-                    current_expiry = current_expiry.replace(tzinfo=None)
-            new_expiry = current_expiry + timedelta(days=additional_days)
-            new_expiry_str = new_expiry
-        
-        cursor.execute(f'''
-            UPDATE users
-            SET expiry_date = {placeholder}
-            WHERE group_id = {placeholder} AND user_id = {placeholder}
-        ''', (new_expiry_str, group_id, user_id))
-        
-        conn.commit()
+        SELECT id, timestamp, message, group_id, group_name, matched_keywords
+        FROM messages
+        WHERE {cursor_sql}
+        ORDER BY id {order}
+        LIMIT {placeholder}
+    ''', cursor_params + [limit])
     
+    messages = map_rows(MessageRow, cursor.fetchall())
     conn.close()
+    return messages if order == 'DESC' else messages[::-1]
 
-def reduce_user_expiry(group_id, user_id, reduce_days):
-    """Reduce user expiry (but not below current date) - Returns error if would go negative"""
+def search_terms(text):
+    """Words and "quoted phrases" of a search query - every one must appear in a match"""
+    return [phrase or word for phrase, word in re.findall(r'"([^"]+)"|(\S+)', text)]
+
+def fts_match_query(text):
+    """FTS5 MATCH string from user input, every term quoted so FTS5 operators are taken literally"""
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in search_terms(text))
+
+SEARCH_RANK_WINDOW = int(os.environ.get('SEARCH_RANK_WINDOW', 10000))   # SQLite: rank only the newest N matches (0 = all)
+
+@db_timed
+def search_messages(text=None, group_id=None, keyword=None, since=None, until=None, limit=50, offset=0, sort='rank'):
+    """(MessageRow, rank) pairs matching a full-text query and filters - best match first with
+    sort='rank', else (and always without a query) newest first; since/until are epoch seconds"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    where, params = [], []
+    if group_id:
+        where.append(f'm.group_id = {placeholder}')
+        params.append(group_id)
+    if keyword:
+        # matched_keywords is a ', '-joined list - match whole keywords only
+        where.append(f"(', ' || UPPER(m.matched_keywords) || ', ') LIKE {placeholder}")
+        params.append(f'%, {keyword.upper()}, %')
+    if since is not None:
+        where.append(f'm.timestamp >= {placeholder}')
+        params.append(since)
+        # An id bound lets the id-ordered scans below stop early. Ids only roughly follow timestamps
+        # (rows are stamped before the insert takes the write lock), so it's the smallest matching id
+        cursor.execute(f'SELECT MIN(id) FROM messages WHERE timestamp >= {placeholder}', (since,))
+        first = cursor.fetchone()[0]
+        where.append(f'm.id >= {placeholder}')
+        params.append(first if first is not None else 2 ** 62)
+    if until is not None:
+        where.append(f'm.timestamp < {placeholder}')
+        params.append(until)
+    
+    source, rank = 'messages m', '0'
+    order = 'm.id DESC'
+    if text and DATABASE_TYPE == 'sqlite' and fts_enabled:
+        source = 'messages_fts JOIN messages m ON m.id = messages_fts.rowid'
+        where = [w.replace('m.id >=', 'messages_fts.rowid >=') for w in where]   # Bounds the FTS5 scan itself
+        where.insert(0, 'messages_fts MATCH ?')
+        params.insert(0, fts_match_query(text))
+        order = 'messages_fts.rowid DESC'   # rowid order streams from the index
+        if sort == 'rank':
+            rank = '-bm25(messages_fts)'   # Reads corpus-wide term statistics, so newest-first skips it
+            if SEARCH_RANK_WINDOW > 0:
+                # bm25 scores every candidate, so bound them: find where the newest N matches start
+                cursor.execute(f'''
+                    SELECT messages_fts.rowid FROM {source} WHERE {' AND '.join(where)}
+                    ORDER BY messages_fts.rowid DESC LIMIT 1 OFFSET ?
+                ''', params + [SEARCH_RANK_WINDOW - 1])
+                window_start = cursor.fetchone()
+                if window_start:
+                    where.append('messages_fts.rowid >= ?')
+                    params.append(window_start[0])
+            order = 'bm25(messages_fts), m.id DESC'
+    elif text and DATABASE_TYPE == 'postgresql':
+        where.insert(0, "m.search_vector @@ websearch_to_tsquery('simple', %s)")
+        params.insert(0, text)
+        rank = "ts_rank(m.search_vector, websearch_to_tsquery('simple', %s))"
+        params.insert(0, text)   # score comes first in the SELECT list
+        if sort == 'rank':
+            order = 'score DESC, m.id DESC'
+    elif text:
+        # No FTS5 in this SQLite build - a full scan, but the same AND-of-words semantics
+        for term in search_terms(text):
+            where.append('m.message LIKE ?')
+            params.append(f'%{term}%')
+    
     cursor.execute(f'''
-        SELECT expiry_date FROM users
-        WHERE group_id = {placeholder} AND user_id = {placeholder}
-    ''', (group_id, user_id))
+        SELECT m.id, m.timestamp, m.message, m.group_id, m.group_name, m.matched_keywords, {rank} AS score
+        FROM {source}
+        WHERE {' AND '.join(where) or '1 = 1'}
+        ORDER BY {order}
+        LIMIT {placeholder} OFFSET {placeholder}
+    ''', params + [limit, offset])
     
-    result = cursor.fetchone()
-    if result:
-        if DATABASE_TYPE == 'sqlite':
-            current_expiry = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-        else:  # postgresql
-            # Parse the result - it might be datetime or string
-            if isinstance(result[0], str):
-                # It's a string, parse it
-                try:
-                    current_expiry = datetime.strptime(result[0], '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    # Try with microseconds
-                    current_expiry = datetime.strptime(result[0].split('.')[0], '%Y-%m-%d %H:%M:%S')
-            else:
-                # It's already a datetime object
-                current_expiry = result[0]
-                # Remove timezone for comparison if present
-                if hasattr(current_expiry, 'tzinfo') and current_expiry.tzinfo is not None:
-                    current_expiry = current_expiry.replace(tzinfo=None)
-        
-        # Calculate what the new expiry would be
-        new_expiry = current_expiry - timedelta(days=reduce_days)
-        current_time = datetime.now()
-        
-        # Check if reduction would result in negative days
-        if new_expiry < current_time:
-            # Calculate how many days they currently have left
-            days_left = max(0, (current_expiry - current_time).days)
-            conn.close()
-            return {'error': f'Cannot reduce by {reduce_days} days. User only has {days_left} days left. Maximum you can reduce is {days_left} days.'}
+    results = [(MessageRow(*row[:6]), float(row[6])) for row in cursor.fetchall()]
+    conn.close()
+    return results
+
+STATS_RECONCILE_SECONDS = int(os.environ.get('STATS_RECONCILE_SECONDS', 600))   # Full recount interval
+
+class StatsCounters:
+    """In-memory user/message counters kept current by the write helpers.
+    
+    Loaded with one full count on first use, then updated by add_user,
+    remove_user and log_message, and recounted from the database every
+    STATS_RECONCILE_SECONDS (in the background) to absorb drift - e.g.
+    writes made by another process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._reconciling = False
+        self._reconciled_at = 0.0
+        self._user_rows = {}                      # (group_id, user_id) -> status
+        self._user_groups = defaultdict(int)      # user_id -> number of groups
+        self._group_messages = defaultdict(int)   # group_id -> messages logged
+        self._group_users = defaultdict(int)      # group_id -> users
+        self._group_active = defaultdict(int)     # group_id -> active users
+        self._active = 0
+
+    def reconcile(self):
+        """Recount everything from the database"""
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT group_id, user_id, status FROM users')
+        user_rows = {(str(g), str(u)): s for g, u, s in cursor.fetchall()}
+        cursor.execute('SELECT group_id, COUNT(*) FROM messages GROUP BY group_id')
+        group_messages = defaultdict(int, {str(g): n for g, n in cursor.fetchall()})
+        conn.close()
         
-        # Safe to reduce
-        if DATABASE_TYPE == 'sqlite':
-            new_expiry_str = new_expiry.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            new_expiry_str = new_expiry
+        user_groups = defaultdict(int)
+        group_users = defaultdict(int)
+        group_active = defaultdict(int)
+        for (group_id, user_id), status in user_rows.items():
+            user_groups[user_id] += 1
+            group_users[group_id] += 1
+            group_active[group_id] += status == 'active'
         
-        cursor.execute(f'''
-            UPDATE users
-            SET expiry_date = {placeholder}
-            WHERE group_id = {placeholder} AND user_id = {placeholder}
-        ''', (new_expiry_str, group_id, user_id))
+        with self._lock:
+            self._user_rows = user_rows
+            self._user_groups = user_groups
+            self._group_users = group_users
+            self._group_active = group_active
+            self._group_messages = group_messages
+            self._active = sum(1 for s in user_rows.values() if s == 'active')
+            self._loaded = True
+            self._reconciled_at = time.monotonic()
+
+    def _reconcile_in_background(self):
+        try:
+            self.reconcile()
+        except Exception:
+            log.exception("❌ Stats reconcile error")
+        finally:
+            self._reconciling = False
+
+    def user_upserted(self, group_id, user_id, status):
+        with self._lock:
+            if not self._loaded:
+                return
+            key = (str(group_id), str(user_id))
+            previous = self._user_rows.get(key)
+            if previous is None:
+                self._user_groups[key[1]] += 1
+                self._group_users[key[0]] += 1
+            change = (status == 'active') - (previous == 'active')
+            self._active += change
+            self._group_active[key[0]] += change
+            self._user_rows[key] = status
+
+    def user_removed(self, group_id, user_id):
+        with self._lock:
+            if not self._loaded:
+                return
+            key = (str(group_id), str(user_id))
+            previous = self._user_rows.pop(key, None)
+            if previous is None:
+                return
+            self._active -= previous == 'active'
+            self._group_active[key[0]] -= previous == 'active'
+            self._user_groups[key[1]] -= 1
+            if self._user_groups[key[1]] <= 0:
+                del self._user_groups[key[1]]
+            self._group_users[key[0]] -= 1
+            if self._group_users[key[0]] <= 0:
+                del self._group_users[key[0]]
+                self._group_active.pop(key[0], None)
+
+    def message_logged(self, group_id, count=1):
+        with self._lock:
+            if self._loaded:
+                self._group_messages[str(group_id)] += count
+
+    def snapshot(self):
+        """Totals plus per-group breakdown - O(groups) (independent of the number of users
+        and messages), no database access once loaded"""
+        if not self._loaded:
+            self.reconcile()
+        elif time.monotonic() - self._reconciled_at > STATS_RECONCILE_SECONDS and not self._reconciling:
+            self._reconciling = True
+            threading.Thread(target=self._reconcile_in_background, daemon=True).start()
         
-        conn.commit()
-        conn.close()
-        return {'success': True}
-    
+        with self._lock:
+            names = {config['group_id']: config['name'] for config in GROUPS.values()}
+            groups = {}
+            for group_id in itertools.chain(names, self._group_messages, self._group_users):
+                if group_id not in groups:
+                    groups[group_id] = {'name': names.get(group_id, 'Unknown'),
+                                        'users': self._group_users.get(group_id, 0),
+                                        'active_users': self._group_active.get(group_id, 0),
+                                        'messages': self._group_messages.get(group_id, 0)}
+            
+            return {
+                'total_users': len(self._user_groups),
+                'active_users': self._active,
+                'total_messages': sum(self._group_messages.values()),
+                'groups': groups,
+                'stats_age_seconds': round(time.monotonic() - self._reconciled_at, 1)
+            }
+
+stats_counters = StatsCounters()
+
+def get_stats():
+    """Get statistics (served from incrementally maintained counters)"""
+    stats = stats_counters.snapshot()
+    stats['enabled_groups'] = sum(1 for g in GROUPS.values() if g['enabled'])
+    return stats
+
+# ═══════════════════════════════════════════════════════════════════════════
+# ⌛ EXPIRY SWEEPER
+# ═══════════════════════════════════════════════════════════════════════════
+
+EXPIRY_SWEEP_INTERVAL = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 300))   # Seconds between sweeps (0 = off)
+EXPIRY_SWEEP_BATCH = int(os.environ.get('EXPIRY_SWEEP_BATCH', 500))            # Users handled per sweep pass
+EXPIRY_BAN_USERS = os.environ.get('EXPIRY_BAN_USERS', 'True').lower() == 'true'
+# Days before expiry to DM a reminder, e.g. "3,1" (empty = no reminders)
+EXPIRY_REMINDER_DAYS = sorted(int(d) for d in os.environ.get('EXPIRY_REMINDER_DAYS', '').split(',') if d.strip())
+
+last_sweep = {}   # Summary of the most recent sweep (see /api/stats)
+
+@db_timed
+def find_expired_users(now, limit):
+    """Active users whose expiry has passed - an index range scan on (status, expiry_date)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    cursor.execute(f'''
+        SELECT group_id, user_id FROM users
+        WHERE status = 'active' AND expiry_date <= {placeholder}
+        ORDER BY expiry_date
+        LIMIT {placeholder}
+    ''', (now, limit))
+    rows = [(group_id, user_id) for group_id, user_id in cursor.fetchall()]
     conn.close()
-    return {'error': 'User not found'}
+    return rows
 
-def remove_user(group_id, user_id):
-    """Remove user from database"""
+@db_timed
+def find_reminder_due_users(now, days, limit):
+    """Active users expiring within `days` who haven't had a reminder that close to expiry yet"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
     placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
-    cursor.execute(f'DELETE FROM users WHERE group_id = {placeholder} AND user_id = {placeholder}', (group_id, user_id))
-    
-    conn.commit()
+    cursor.execute(f'''
+        SELECT group_id, user_id, expiry_date FROM users
+        WHERE status = 'active' AND expiry_date > {placeholder} AND expiry_date <= {placeholder}
+          AND (reminder_days IS NULL OR reminder_days > {placeholder})
+        ORDER BY expiry_date
+        LIMIT {placeholder}
+    ''', (now, now + days * DAY_SECONDS, days, limit))
+    rows = [(group_id, user_id, expiry) for group_id, user_id, expiry in cursor.fetchall()]
     conn.close()
+    return rows
 
-def log_message(message, group_id, group_name, matched_keywords):
-    """Log message sent to group"""
+@db_timed
+def mark_users_expired(keys, now):
+    """Set status 'expired' for the (group_id, user_id) keys still active and expired at `now`,
+    in one transaction - returns the keys changed (a user extended meanwhile is left alone)"""
+    if not keys:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if DATABASE_TYPE == 'sqlite':
+            changed = []
+            for group_id, user_id in keys:
+                cursor.execute('''
+                    UPDATE users SET status = 'expired', days_left = 0
+                    WHERE group_id = ? AND user_id = ? AND status = 'active' AND expiry_date <= ?
+                ''', (group_id, user_id, now))
+                if cursor.rowcount == 1:
+                    changed.append((group_id, user_id))
+        else:
+            import psycopg2.extras
+            changed = psycopg2.extras.execute_values(cursor, f'''
+                UPDATE users u SET status = 'expired', days_left = 0
+                FROM (VALUES %s) AS v (group_id, user_id)
+                WHERE u.group_id = v.group_id AND u.user_id = v.user_id
+                  AND u.status = 'active' AND u.expiry_date <= {int(now)}
+                RETURNING u.group_id, u.user_id
+            ''', keys, fetch=True)
+            changed = [tuple(row) for row in changed]
+        conn.commit()
+        return changed
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@db_timed
+def mark_users_reminded(keys, days):
+    """Record that every (group_id, user_id) in keys got the `days` reminder, in one transaction"""
+    if not keys:
+        return
     conn = get_db_connection()
     cursor = conn.cursor()
+    try:
+        if DATABASE_TYPE == 'sqlite':
+            cursor.executemany('UPDATE users SET reminder_days = ? WHERE group_id = ? AND user_id = ?',
+                               [(days, g, u) for g, u in keys])
+        else:
+            import psycopg2.extras
+            psycopg2.extras.execute_values(cursor, '''
+                UPDATE users u SET reminder_days = v.days
+                FROM (VALUES %s) AS v (group_id, user_id, days)
+                WHERE u.group_id = v.group_id AND u.user_id = v.user_id
+            ''', [(g, u, days) for g, u in keys])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def group_name_for(group_id):
+    """Configured name for a group id (the id itself when unknown)"""
+    for config in GROUPS.values():
+        if str(config['group_id']) == str(group_id):
+            return config['name']
+    return group_id
+
+def sweep_expired_users():
+    """Ban and mark expired users, then send due pre-expiry reminders - returns a summary"""
+    global last_sweep
+    started = time.monotonic()
+    now = now_epoch()
+    summary = {'expired': 0, 'ban_failed': 0, 'reminded': 0}
     
-    timestamp = datetime.now()
+    # Expired users, a batch at a time - only due rows are read
+    failed = set()   # Failed bans stay active and are retried next sweep
+    while True:
+        limit = EXPIRY_SWEEP_BATCH + len(failed)
+        rows = find_expired_users(now, limit)
+        due = [key for key in rows if key not in failed]
+        if not due:
+            break
+        if EXPIRY_BAN_USERS:
+            bans = [bulk_executor.submit(ban_user_from_group, g, u) for g, u in due]
+            banned = [key for key, future in zip(due, bans) if future.result()]
+        else:
+            banned = due
+        failed.update(set(due) - set(banned))
+        expired = mark_users_expired(banned, now)
+        for group_id, user_id in expired:
+            stats_counters.user_upserted(group_id, user_id, 'expired')
+            invalidate_membership(group_id, user_id)
+        summary['expired'] += len(expired)
+        summary['ban_failed'] += len(due) - len(banned)
+        if len(rows) < limit:
+            break
     
-    if DATABASE_TYPE == 'sqlite':
-        timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute('''
-            INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (timestamp_str, message, group_id, group_name, matched_keywords))
-    elif DATABASE_TYPE == 'postgresql':
-        cursor.execute('''
-            INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (timestamp, message, group_id, group_name, matched_keywords))
+    # Closest threshold first, so a user inside several windows gets one reminder
+    for days in EXPIRY_REMINDER_DAYS:
+        due = find_reminder_due_users(now, days, EXPIRY_SWEEP_BATCH)
+        sends = [
+            bulk_executor.submit(send_to_telegram, user_id,
+                                 f"⏰ Your access to {group_name_for(group_id)} expires in "
+                                 f"{max(1, (expiry - now) // DAY_SECONDS)} day(s) ({format_epoch(expiry)[:16]}).\n"
+                                 f"Contact the admin to renew.")
+            for group_id, user_id, expiry in due
+        ]
+        reminded = [(g, u) for (g, u, _), future in zip(due, sends) if future.result()]
+        mark_users_reminded(reminded, days)
+        summary['reminded'] += len(reminded)
     
-    conn.commit()
-    conn.close()
+    summary['at'] = format_epoch(now)
+    summary['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+    last_sweep = summary
+    if summary['expired'] or summary['ban_failed'] or summary['reminded']:
+        log.info("⌛ Expiry sweep finished", extra=summary)
+    return summary
+
+def expiry_sweeper():
+    """Background thread - runs sweep_expired_users every EXPIRY_SWEEP_INTERVAL seconds"""
+    while True:
+        time.sleep(EXPIRY_SWEEP_INTERVAL)
+        if not hold_job_lease('expiry-sweeper', EXPIRY_SWEEP_INTERVAL):
+            continue   # Another worker sends the reminders and bans
+        try:
+            sweep_expired_users()
+        except Exception:
+            log.exception("❌ Expiry sweep error")
+
+# ═══════════════════════════════════════════════════════════════════════════
+# 🧹 MESSAGE RETENTION
+# ═══════════════════════════════════════════════════════════════════════════
+
+MESSAGE_RETENTION_DAYS = float(os.environ.get('MESSAGE_RETENTION_DAYS', 0))      # Delete messages older than this (0 = keep)
+MESSAGE_RETENTION_MAX_ROWS = int(os.environ.get('MESSAGE_RETENTION_MAX_ROWS', 0))  # Keep at most this many newest rows (0 = no cap)
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 3600))   # Seconds between retention passes (0 = off)
+RETENTION_CHUNK = int(os.environ.get('RETENTION_CHUNK', 2000))           # Rows deleted per transaction
+RETENTION_CHUNK_PAUSE = float(os.environ.get('RETENTION_CHUNK_PAUSE', 0.1))   # Seconds between chunks, lets writers in
+RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', '')      # Write pruned rows to gzipped JSONL here ('' = don't)
+SQLITE_MAINTENANCE_INTERVAL = float(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', 7 * DAY_SECONDS))   # VACUUM + ANALYZE (0 = off)
 
-def get_messages_by_group(group_id, limit=50):
-    """Get messages for specific group"""
+last_retention = {}   # Summary of the most recent retention pass (see /api/stats)
+last_maintenance = time.monotonic()
+
+@db_timed
+def find_retention_cutoff_id():
+    """Highest message id that MESSAGE_RETENTION_MAX_ROWS no longer keeps (None = under the cap)"""
+    if MESSAGE_RETENTION_MAX_ROWS <= 0:
+        return None
     conn = get_db_connection()
     cursor = conn.cursor()
-    
     placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
-    cursor.execute(f'''
-        SELECT timestamp, message, matched_keywords
-        FROM messages
-        WHERE group_id = {placeholder}
-        ORDER BY id DESC
-        LIMIT {placeholder}
-    ''', (group_id, limit))
-    
-    messages = cursor.fetchall()
+    cursor.execute(f'SELECT id FROM messages ORDER BY id DESC LIMIT 1 OFFSET {placeholder}', (MESSAGE_RETENTION_MAX_ROWS,))
+    row = cursor.fetchone()
     conn.close()
-    return messages
+    return row[0] if row else None
 
-def get_all_messages(limit=100):
-    """Get all messages across all groups"""
+@db_timed
+def oldest_messages(limit):
+    """The oldest message rows - a primary key range scan"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
     placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
     cursor.execute(f'''
-        SELECT timestamp, message, group_name, matched_keywords
-        FROM messages
-        ORDER BY id DESC
-        LIMIT {placeholder}
+        SELECT id, timestamp, message, group_id, group_name, matched_keywords
+        FROM messages ORDER BY id LIMIT {placeholder}
     ''', (limit,))
-    
-    messages = cursor.fetchall()
+    rows = map_rows(MessageRow, cursor.fetchall())
     conn.close()
-    return messages
+    return rows
 
-def get_stats():
-    """Get statistics"""
+@db_timed
+def delete_message_range(first_id, last_id):
+    """Delete messages (and their alert_log rows) with ids in [first_id, last_id] in one short transaction"""
     conn = get_db_connection()
     cursor = conn.cursor()
+    placeholder = '?' if DATABASE_TYPE == 'sqlite' else '%s'
+    try:
+        cursor.execute(f'DELETE FROM alert_log WHERE message_id BETWEEN {placeholder} AND {placeholder}', (first_id, last_id))
+        if DATABASE_TYPE == 'sqlite' and fts_enabled:
+            # External content FTS rows are removed with the text they were built from
+            cursor.execute('''
+                INSERT INTO messages_fts (messages_fts, rowid, message)
+                SELECT 'delete', id, message FROM messages WHERE id BETWEEN ? AND ?
+            ''', (first_id, last_id))
+        cursor.execute(f'DELETE FROM messages WHERE id BETWEEN {placeholder} AND {placeholder}', (first_id, last_id))
+        deleted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return deleted
+
+def archive_messages(rows):
+    """Write rows to a gzipped JSONL segment named after their id range - returns the path"""
+    import gzip
+    os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(RETENTION_ARCHIVE_DIR, f"messages-{rows[0].id:010d}-{rows[-1].id:010d}.jsonl.gz")
+    partial = path + '.part'
+    with gzip.open(partial, 'wt', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row._asdict(), ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)   # Segments appear complete or not at all
+    return path
+
+def sqlite_maintenance():
+    """Reclaim free pages and refresh planner statistics (VACUUM blocks writers while it runs)"""
+    global last_maintenance
+    conn = get_db_connection()
+    try:
+        started = time.monotonic()
+        conn.execute('VACUUM')
+        conn.execute('ANALYZE')
+        log.info("🧽 SQLite maintenance finished", extra={'latency_ms': round((time.monotonic() - started) * 1000, 1)})
+    finally:
+        conn.close()
+    last_maintenance = time.monotonic()
+
+def prune_messages():
+    """Delete (and optionally archive) messages past the age/row-count limits, oldest first, a chunk at a time"""
+    global last_retention
+    started = time.monotonic()
+    cutoff_time = now_epoch() - MESSAGE_RETENTION_DAYS * DAY_SECONDS if MESSAGE_RETENTION_DAYS > 0 else None
+    cutoff_id = find_retention_cutoff_id()
+    summary = {'deleted': 0, 'archived_segments': 0}
     
-    cursor.execute('SELECT COUNT(DISTINCT user_id) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM users WHERE status = 'active'")
-    active_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM messages')
-    total_messages = cursor.fetchone()[0]
-    
-    enabled_groups = sum(1 for g in GROUPS.values() if g['enabled'])
-    
-    conn.close()
+    # Ids grow with time, so expired rows are a prefix of the id order
+    while cutoff_time is not None or cutoff_id is not None:
+        rows = oldest_messages(RETENTION_CHUNK)
+        expired = list(itertools.takewhile(
+            lambda row: (cutoff_time is not None and (row.timestamp or 0) < cutoff_time) or
+                        (cutoff_id is not None and row.id <= cutoff_id), rows))
+        if not expired:
+            break
+        if RETENTION_ARCHIVE_DIR:
+            archive_messages(expired)   # Raises before anything is deleted if the segment can't be written
+            summary['archived_segments'] += 1
+        summary['deleted'] += delete_message_range(expired[0].id, expired[-1].id)
+        pruned_per_group = defaultdict(int)
+        for row in expired:
+            pruned_per_group[row.group_id] += 1
+        for group_id, count in pruned_per_group.items():
+            stats_counters.message_logged(group_id, -count)
+        if len(expired) < RETENTION_CHUNK:
+            break
+        time.sleep(RETENTION_CHUNK_PAUSE)
     
-    return {
-        'total_users': total_users,
-        'active_users': active_users,
-        'total_messages': total_messages,
-        'enabled_groups': enabled_groups
-    }
+    summary['at'] = format_epoch(now_epoch())
+    summary['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+    last_retention = summary
+    if summary['deleted']:
+        log.info("🧹 Message retention pass finished", extra=summary)
+    return summary
+
+def retention_worker():
+    """Background thread - prunes messages every RETENTION_INTERVAL seconds, with periodic SQLite maintenance"""
+    while True:
+        time.sleep(RETENTION_INTERVAL)
+        if not hold_job_lease('retention', RETENTION_INTERVAL):
+            continue   # Another worker prunes and archives
+        try:
+            prune_messages()
+            if (DATABASE_TYPE == 'sqlite' and SQLITE_MAINTENANCE_INTERVAL > 0 and
+                    time.monotonic() - last_maintenance >= SQLITE_MAINTENANCE_INTERVAL):
+                sqlite_maintenance()
+        except Exception:
+            log.exception("❌ Retention error")
 
 # ═══════════════════════════════════════════════════════════════════════════
 # 🌐 API ROUTES
@@ -659,15 +3187,17 @@ def home():
     return send_from_directory('static', 'index.html')
 
 @app.route('/webhook/router', methods=['POST'])
+@timed(webhook_request_seconds)
 def webhook_router():
     """Main webhook - receives TradingView alerts and adds to buffer"""
+    dedup_key = None
     try:
         # Get raw data
         content_type = request.headers.get('Content-Type', '')
         
         # Handle JSON format (TradingView default)
         if 'application/json' in content_type:
-            data = request.get_json()
+            data = request.get_json(silent=True)
             if data and isinstance(data, dict):
                 # Try different possible keys TradingView might use
                 raw_data = data.get('message') or data.get('text') or data.get('alert') or data.get('data') or str(data)
@@ -678,61 +3208,35 @@ def webhook_router():
             raw_data = request.data.decode('utf-8')
         
         if not raw_data:
-            print("❌ ERROR: No data received!", flush=True)
             return jsonify({'error': 'No data received'}), 400
         
-        print("\n" + "═" * 70, flush=True)
-        print("🔔 ALERT RECEIVED - ADDING TO BUFFER", flush=True)
-        print("═" * 70, flush=True)
-        print(f"Content-Type: {content_type}", flush=True)
-        print(f"Raw Request Data: {request.data[:200]}", flush=True)
-        print(f"Processed Message: {raw_data}", flush=True)
-        print("─" * 70, flush=True)
+        # Drop webhook retries before they reach the buffer (200 so the sender stops retrying).
+        # The key is recorded now so concurrent retries can't both pass, and forgotten again
+        # below if the alert is not accepted - the sender's retry must not look like a duplicate
+        dedup_key = alert_dedup_key(raw_data, request.headers.get(ALERT_DEDUP_HEADER))
+        if dedup_key and alert_dedup.check(dedup_key):
+            log.info("♊ Duplicate alert suppressed", extra={'preview': str(raw_data)[:100]})
+            return jsonify({'success': True, 'duplicate': True}), 200
         
-        # Route to appropriate groups based on keywords
-        message_upper = str(raw_data).upper()
-        routed_to = []
-        
-        print(f"🔍 Searching for keywords in: {message_upper[:100]}", flush=True)
+        # Fast path: hand off to the ingest workers and answer immediately
+        if WEBHOOK_ASYNC_INGEST:
+            try:
+                ingest_queue.put_nowait(str(raw_data))
+            except queue.Full:
+                if dedup_key:
+                    alert_dedup.forget(dedup_key)
+                return jsonify({'error': 'Ingest queue full, retry later'}), 503
+            return jsonify({'success': True, 'queued': True}), 202
         
-        for group_key, group_config in GROUPS.items():
-            if not group_config['enabled']:
-                print(f"⏸️  Skipping disabled group: {group_config['name']}", flush=True)
-                continue
-            
-            for keyword in group_config['keywords']:
-                print(f"   Checking keyword '{keyword}' in message...", flush=True)
-                if keyword.upper() in message_upper:
-                    group_id = group_config['group_id']
-                    group_name = group_config['name']
-                    
-                    print(f"   ✅ MATCH! Keyword '{keyword}' found!", flush=True)
-                    
-                    # Add to buffer instead of sending immediately
-                    add_to_buffer(group_id, group_name, str(raw_data), keyword)
-                    routed_to.append({'group_name': group_name})
-                    
-                    break
-                else:
-                    print(f"   ❌ No match for '{keyword}'", flush=True)
+        routed_to = route_alert(raw_data)
         
         if routed_to:
-            print(f"✅ Added to {len(routed_to)} buffer(s)", flush=True)
-            for item in routed_to:
-                print(f"   → {item['group_name']}", flush=True)
-            print("═" * 70 + "\n", flush=True)
-            
             return jsonify({
                 'success': True,
                 'buffered_in_groups': len(routed_to),
-                'groups': [item['group_name'] for item in routed_to]
+                'groups': routed_to
             }), 200
         else:
-            print("⚠️  NO GROUPS MATCHED!", flush=True)
-            print(f"   Message received: {raw_data[:200]}", flush=True)
-            print(f"   Available keywords: {[kw for g in GROUPS.values() for kw in g['keywords']]}", flush=True)
-            print("═" * 70 + "\n", flush=True)
-            
             return jsonify({
                 'success': False,
                 'error': 'No matching groups',
@@ -740,31 +3244,63 @@ def webhook_router():
             }), 200
         
     except Exception as e:
-        print(f"\n❌ WEBHOOK ERROR: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        if dedup_key:
+            alert_dedup.forget(dedup_key)
+        log.exception("❌ WEBHOOK ERROR")
         return jsonify({'error': str(e)}), 500
 
+def buffer_state():
+    """Current buffer contents and next flush time (/api/buffer and 'buffer' events)"""
+    buf = []
+    for gid, msgs in pending_buffer().items():
+        group_name = next((g['name'] for g in GROUPS.values() if g['group_id'] == gid), 'Unknown')
+        buf.append({
+            'group_id': gid,
+            'group_name': group_name,
+            'count': len(msgs),
+            'messages': msgs
+        })
+    
+    next_send_in = int(seconds_until_next_flush())
+    
+    return {
+        'buffer': buf,
+        'next_send_in_seconds': next_send_in,
+        'backend': BUFFER_BACKEND,
+        'last_flush': last_flush
+    }
+
 @app.route('/api/buffer', methods=['GET'])
 def api_buffer():
     """Get current buffer status"""
-    with buffer_lock:
-        buf = []
-        for gid, msgs in message_buffer.items():
-            group_name = next((g['name'] for g in GROUPS.values() if g['group_id'] == gid), 'Unknown')
-            buf.append({
-                'group_id': gid,
-                'group_name': group_name,
-                'count': len(msgs),
-                'messages': msgs
-            })
+    return jsonify(buffer_state()), 200
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """Server-Sent Events stream: 'buffer', 'flush' and 'message' events"""
+    q = event_broker.subscribe()
     
-    next_send_in = max(0, 60 - (datetime.now() - last_batch_time).seconds)
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            # Full buffer state first so (re)connecting clients never need to poll
+            yield f"event: buffer\ndata: {json.dumps(buffer_state(), default=str)}\n\n"
+            while True:
+                try:
+                    item = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield item
+        finally:
+            event_broker.unsubscribe(q)
     
-    return jsonify({
-        'buffer': buf,
-        'next_send_in_seconds': next_send_in
-    }), 200
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/api/stats', methods=['GET'])
 def api_stats():
@@ -772,35 +3308,71 @@ def api_stats():
     stats = get_stats()
     
     # Add buffered message count
-    with buffer_lock:
-        buffered = sum(len(m) for m in message_buffer.values())
-    stats['buffered_messages'] = buffered
+    stats['buffered_messages'] = sum(len(m) for m in pending_buffer().values())
+    stats['ingest_queue_depth'] = ingest_queue.qsize()
+    stats['duplicates_suppressed'] = alert_dedup.suppressed
+    stats['log_dropped'] = log_handler.dropped
+    stats['db_pool'] = db_pool.stats()
+    stats['caches'] = {name: cache.stats() for name, cache in telegram_caches.items()}
+    stats['last_expiry_sweep'] = last_sweep
+    stats['last_retention'] = last_retention
     
     return jsonify(stats), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics disabled'}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/messages', methods=['GET'])
 def api_all_messages():
-    """Get all messages"""
-    limit = request.args.get('limit', 50, type=int)
-    messages = get_all_messages(limit)
-    
-    result = []
-    for timestamp, message, group_name, keywords in messages:
-        # Format timestamp for display
-        if DATABASE_TYPE == 'postgresql':
-            timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(timestamp, datetime) else str(timestamp)
-        else:
-            timestamp_str = timestamp
-            
-        result.append({
-            'timestamp': timestamp_str,
-            'message': message,
-            'group_name': group_name,
-            'keywords': keywords,
-            'status': 'sent'
-        })
+    """Get all messages (?limit=, ?before_id= for older pages, ?after_id= for newer rows)"""
+    limit = max(request.args.get('limit', 50, type=int), 1)
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    messages = get_all_messages(limit, before_id, after_id)
+    
+    result = [row.to_api() for row in messages]
+    
+    return jsonify({
+        'messages': result,
+        'next_before_id': result[-1]['id'] if result and len(result) == limit else None
+    }), 200
+
+def parse_time_arg(name):
+    """Epoch seconds from a query arg given as epoch, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS' (local time)"""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    if len(value) == 10:
+        value += ' 00:00:00'
+    return to_epoch(value)
+
+@app.route('/api/messages/search', methods=['GET'])
+def api_search_messages():
+    """Full-text message search (?q=, ?group_id=, ?keyword=, ?since=, ?until=, ?sort=rank|newest, ?limit=, ?offset=)"""
+    text = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'rank')
+    if sort not in ('rank', 'newest'):
+        return jsonify({'error': 'sort must be rank or newest'}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    try:
+        since, until = parse_time_arg('since'), parse_time_arg('until')
+    except ValueError:
+        return jsonify({'error': "since/until must be epoch seconds, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'"}), 400
+    
+    results = search_messages(text, request.args.get('group_id'), request.args.get('keyword'),
+                              since, until, limit, offset, sort)
     
-    return jsonify({'messages': result}), 200
+    return jsonify({
+        'messages': [dict(row.to_api(), rank=round(rank, 6)) for row, rank in results],
+        'next_offset': offset + limit if len(results) == limit else None
+    }), 200
 
 @app.route('/api/groups', methods=['GET'])
 def api_groups():
@@ -822,65 +3394,21 @@ def api_groups():
 def api_group_users(group_id):
     """Get users for specific group"""
     try:
-        users = get_users_by_group(group_id)
+        now = now_epoch()
+        # Expired rows and users with less than a day left are filtered in SQL
+        users = get_users_by_group(group_id, min_expiry=now + DAY_SECONDS)
+        result = [user.to_api(now) for user in users]
         
-        result = []
-        current_time = datetime.now()
-        
-        for user_id, name, invited, expiry, days, status in users:
-            try:
-                joined = check_user_in_group(group_id, user_id)
-                
-                # Format dates for display
-                if DATABASE_TYPE == 'postgresql':
-                    invited_str = invited.strftime('%Y-%m-%d %H:%M:%S') if isinstance(invited, datetime) else str(invited)
-                    expiry_str = expiry.strftime('%Y-%m-%d %H:%M:%S') if isinstance(expiry, datetime) else str(expiry)
-                    
-                    # Parse expiry date
-                    if isinstance(expiry, datetime):
-                        expiry_date = expiry
-                    else:
-                        try:
-                            expiry_date = datetime.strptime(expiry, '%Y-%m-%d %H:%M:%S')
-                        except:
-                            expiry_date = datetime.strptime(str(expiry), '%Y-%m-%d %H:%M:%S.%f')
-                    
-                    # Remove timezone info for comparison
-                    if hasattr(expiry_date, 'tzinfo') and expiry_date.tzinfo is not None:
-                        expiry_date = expiry_date.replace(tzinfo=None)
-                else:
-                    invited_str = invited
-                    expiry_str = expiry
-                    expiry_date = datetime.strptime(expiry, '%Y-%m-%d %H:%M:%S')
-                
-                # Calculate days_left dynamically
-                time_diff = expiry_date - current_time
-                days_left_calculated = max(0, time_diff.days)
-                
-                # Skip expired users from display
-                if days_left_calculated <= 0:
-                    continue  # Don't show expired users
-                
-                result.append({
-                    'user_id': user_id,
-                    'name': name,
-                    'invited_date': invited_str,
-                    'expiry_date': expiry_str,
-                    'days_left': days_left_calculated,
-                    'status': status,
-                    'joined': joined
-                })
-            except Exception as e:
-                print(f"❌ Error processing user {user_id} in group {group_id}: {e}")
-                # Continue with next user instead of failing entire request
-                continue
+        # Membership for the listed users only - cached, misses fetched concurrently
+        stale_ok = request.args.get('stale', type=int, default=int(MEMBERSHIP_STALE_WHILE_REVALIDATE)) == 1
+        memberships = get_memberships(group_id, [row['user_id'] for row in result], stale_ok=stale_ok)
+        for row in result:
+            row['joined'] = memberships.get(row['user_id'])
         
         return jsonify({'users': result}), 200
     
     except Exception as e:
-        print(f"❌ Fatal error in api_group_users for {group_id}: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Fatal error in api_group_users", extra={'group_id': group_id})
         return jsonify({'error': str(e), 'users': []}), 200  # Return 200 with empty array instead of 500
 
 @app.route('/api/group/<group_id>/admins', methods=['GET'])
@@ -891,25 +3419,18 @@ def api_group_admins(group_id):
 
 @app.route('/api/group/<group_id>/messages', methods=['GET'])
 def api_group_messages(group_id):
-    """Get messages for specific group"""
-    limit = request.args.get('limit', 20, type=int)
-    messages = get_messages_by_group(group_id, limit)
-    
-    result = []
-    for timestamp, message, keywords in messages:
-        # Format timestamp for display
-        if DATABASE_TYPE == 'postgresql':
-            timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(timestamp, datetime) else str(timestamp)
-        else:
-            timestamp_str = timestamp
-            
-        result.append({
-            'timestamp': timestamp_str,
-            'message': message,
-            'keywords': keywords
-        })
+    """Get messages for specific group (?limit=, ?before_id=, ?after_id=)"""
+    limit = max(request.args.get('limit', 20, type=int), 1)
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    messages = get_messages_by_group(group_id, limit, before_id, after_id)
+    
+    result = [row.to_api() for row in messages]
     
-    return jsonify({'messages': result}), 200
+    return jsonify({
+        'messages': result,
+        'next_before_id': result[-1]['id'] if result and len(result) == limit else None
+    }), 200
 
 @app.route('/api/user/add', methods=['POST'])
 def api_add_user():
@@ -929,6 +3450,7 @@ def api_add_user():
         return jsonify({'error': 'Failed to create invite link'}), 500
     
     add_user(group_id, user_id, days)
+    invalidate_membership(group_id, user_id)
     
     message = f"🎉 You've been invited!\n\nValid for: {days} days\nJoin now: {invite_link}"
     send_to_telegram(user_id, message)
@@ -952,9 +3474,7 @@ def api_extend_user():
         
         return jsonify({'success': True}), 200
     except Exception as e:
-        print(f"❌ Error in api_extend_user: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error in api_extend_user")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user/reduce', methods=['POST'])
@@ -977,9 +3497,7 @@ def api_reduce_user():
         
         return jsonify({'success': True}), 200
     except Exception as e:
-        print(f"❌ Error in api_reduce_user: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error in api_reduce_user")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user/remove', methods=['POST'])
@@ -996,14 +3514,140 @@ def api_remove_user():
         
         ban_user_from_group(group_id, user_id)
         remove_user(group_id, user_id)
+        invalidate_membership(group_id, user_id)
         
         return jsonify({'success': True}), 200
     except Exception as e:
-        print(f"❌ Error in api_remove_user: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error in api_remove_user")
+        return jsonify({'error': str(e)}), 500
+
+BULK_ACTIONS = {'add': 30, 'extend': 30, 'reduce': 1, 'remove': 0}   # action -> default days
+
+@app.route('/api/users/bulk', methods=['POST'])
+def api_bulk_users():
+    """Add/extend/reduce/remove many users - one DB transaction, Telegram calls in parallel.
+    
+    Body: {admin_id, operations: [{action, group_id, user_id, days}]} and/or
+    {admin_id, action, group_id, days, user_ids: [...]} - top-level fields are defaults for every op."""
+    try:
+        data = request.json or {}
+        
+        if data.get('admin_id') != ADMIN_USER_ID:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        defaults = {k: data[k] for k in ('action', 'group_id', 'days') if data.get(k) is not None}
+        raw_ops = list(data.get('operations') or []) + [{'user_id': uid} for uid in data.get('user_ids') or []]
+        if not raw_ops:
+            return jsonify({'error': 'No operations'}), 400
+        if len(raw_ops) > BULK_MAX_OPERATIONS:
+            return jsonify({'error': f'At most {BULK_MAX_OPERATIONS} operations per request'}), 400
+        
+        # Validate - bad ops are reported per user and skipped
+        results, ops = [], []
+        for i, raw in enumerate(raw_ops):
+            op = {**defaults, **{k: v for k, v in (raw if isinstance(raw, dict) else {}).items() if v is not None}}
+            result = {'index': i, 'action': op.get('action'), 'group_id': op.get('group_id'), 'user_id': op.get('user_id')}
+            results.append(result)
+            try:
+                if op.get('action') not in BULK_ACTIONS:
+                    raise ValueError(f"action must be one of {', '.join(BULK_ACTIONS)}")
+                if op.get('group_id') is None or op.get('user_id') is None:
+                    raise ValueError('group_id and user_id are required')
+                days = int(op.get('days', BULK_ACTIONS[op['action']]))
+                if days < 0:
+                    raise ValueError('days must not be negative')
+            except (TypeError, ValueError) as e:
+                result.update({'success': False, 'error': str(e)})
+                continue
+            ops.append({'index': i, 'action': op['action'], 'group_id': str(op['group_id']),
+                        'user_id': str(op['user_id']), 'days': days})
+        
+        # Telegram first (like the single-user routes): invite links + names for adds, bans for removes
+        adds = [op for op in ops if op['action'] == 'add']
+        links = {op['index']: bulk_executor.submit(create_invite_link, op['group_id'], op['days']) for op in adds}
+        names = {op['index']: bulk_executor.submit(get_user_info, op['user_id']) for op in adds}
+        bans = {op['index']: bulk_executor.submit(ban_user_from_group, op['group_id'], op['user_id'])
+                for op in ops if op['action'] == 'remove'}
+        
+        ready = []
+        for op in ops:
+            result = results[op['index']]
+            if op['action'] == 'add':
+                result['invite_link'] = links[op['index']].result()
+                if not result['invite_link']:
+                    result.update({'success': False, 'error': 'Failed to create invite link'})
+                    continue
+                op['name'] = names[op['index']].result()
+            elif op['action'] == 'remove':
+                result['banned'] = bans[op['index']].result()
+            ready.append(op)
+        
+        for op, outcome in zip(ready, apply_user_operations(ready)):
+            results[op['index']].update({'success': False, **outcome} if 'error' in outcome else outcome)
+            if outcome.get('success') and op['action'] in ('add', 'remove'):
+                invalidate_membership(op['group_id'], op['user_id'])
+        
+        # Invite DMs - send_to_telegram applies the per-chat and global limits
+        dms = {op['index']: bulk_executor.submit(
+                   send_to_telegram, op['user_id'],
+                   f"🎉 You've been invited!\n\nValid for: {op['days']} days\nJoin now: {results[op['index']]['invite_link']}")
+               for op in ready if op['action'] == 'add' and results[op['index']].get('success')}
+        for index, future in dms.items():
+            results[index]['message_sent'] = future.result()
+        
+        succeeded = sum(1 for r in results if r.get('success'))
+        return jsonify({
+            'success': succeeded == len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }), 200
+    except Exception as e:
+        log.exception("❌ Error in api_bulk_users")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/expiry/sweep', methods=['POST'])
+def api_expiry_sweep():
+    """Run the expiry sweeper now instead of waiting for the next interval"""
+    data = request.json or {}
+    
+    if data.get('admin_id') != ADMIN_USER_ID:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify(sweep_expired_users()), 200
+
+@app.route('/api/retention/run', methods=['POST'])
+def api_retention_run():
+    """Run a message retention pass now ('maintenance': true also runs VACUUM/ANALYZE on SQLite)"""
+    data = request.json or {}
+    
+    if data.get('admin_id') != ADMIN_USER_ID:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    summary = prune_messages()
+    if data.get('maintenance') and DATABASE_TYPE == 'sqlite':
+        sqlite_maintenance()
+        summary['maintenance'] = True
+    return jsonify(summary), 200
+
+@app.route('/api/cache/clear', methods=['POST'])
+def api_cache_clear():
+    """Clear Telegram read caches (all, or one via 'cache': membership/user_info/admins)"""
+    data = request.json or {}
+    
+    if data.get('admin_id') != ADMIN_USER_ID:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    name = data.get('cache')
+    if name and name not in telegram_caches:
+        return jsonify({'error': f'Unknown cache: {name}'}), 400
+    
+    for cache_name, cache in telegram_caches.items():
+        if not name or cache_name == name:
+            cache.invalidate()
+    
+    return jsonify({'success': True}), 200
+
 @app.route('/api/config', methods=['GET'])
 def api_config():
     """Get configuration"""
@@ -1021,17 +3665,80 @@ def health():
 # 🚀 STARTUP
 # ═══════════════════════════════════════════════════════════════════════════
 
+def start_background_workers():
+    """Start the log writer, buffer, ingest, refresher and sweeper threads (once per process)"""
+    global buffer_wal
+    start_log_listener()
+    if BUFFER_WAL_PATH and BUFFER_BACKEND == 'memory':
+        buffer_wal = BufferWAL(BUFFER_WAL_PATH)
+        replay_buffer_wal()   # Restore unsent messages before the scheduler starts
+    threading.Thread(target=process_buffer, name='buffer', daemon=True).start()
+    
+    if WEBHOOK_ASYNC_INGEST:
+        for _ in range(INGEST_WORKERS):
+            threading.Thread(target=ingest_worker, name='ingest', daemon=True).start()
+    # Keep configured groups' admin lists warm
+    if ADMINS_REFRESH_INTERVAL > 0:
+        threading.Thread(target=refresh_group_admins, name='admins-refresh', daemon=True).start()
+    if EXPIRY_SWEEP_INTERVAL > 0:
+        threading.Thread(target=expiry_sweeper, name='expiry-sweeper', daemon=True).start()
+    if RETENTION_INTERVAL > 0:
+        threading.Thread(target=retention_worker, name='retention', daemon=True).start()
+    log.info("✅ Background workers started", extra={'buffer_backend': BUFFER_BACKEND})
+
+def warm_up():
+    """Create tables, open pooled DB connections and a Bot API connection before traffic needs them"""
+    started = time.monotonic()
+    try:
+        init_database()
+        db_pool.prefill(DB_POOL_PREFILL)
+    except Exception:
+        log.exception("❌ Database warm-up failed")
+        db_ready.set()   # Don't hold requests forever - they will surface the database error themselves
+    try:
+        session = get_telegram_session()
+        if TELEGRAM_BOT_TOKEN:
+            session.get(telegram_url('getMe'), timeout=TELEGRAM_TIMEOUT)   # TLS handshake off the send path
+    except Exception as e:
+        log.warning("⚠️ Telegram warm-up failed", extra={'error': type(e).__name__})   # str(e) would include the token URL
+    log.info("🔥 Warm-up finished", extra={'latency_ms': round((time.monotonic() - started) * 1000, 1)})
+
+booted = False
+boot_lock = threading.Lock()
+
+def boot(wait=False):
+    """Start workers and warm up in the background - called by gunicorn's post_worker_init and
+    __main__. Webhooks are accepted right away; wait=True blocks until the warm-up is done."""
+    global booted
+    with boot_lock:
+        if booted:
+            return
+        booted = True
+    start_background_workers()
+    warm = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    warm.start()
+    if wait:
+        warm.join()
+
+@app.before_request
+def wait_for_database():
+    """Hold API requests (not webhooks, health checks or scrapes) that arrive during a cold start until the tables exist"""
+    if not db_ready.is_set() and request.endpoint not in ('webhook_router', 'home', 'static', 'health', 'metrics'):
+        db_ready.wait(DB_READY_TIMEOUT)
+
 if __name__ == '__main__':
     print("\n" + "═" * 70)
     print("║" + " " * 15 + "TELEGRAM UNIFIED SYSTEM - COMPLETE" + " " * 20 + "║")
     print("═" * 70)
     
-    init_database()
+    # The debug reloader runs this block in a watcher process too - only boot the serving child
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        boot(wait=True)
     
     print(f"✅ Bot Token: {TELEGRAM_BOT_TOKEN[:20]}...")
     print(f"✅ Admin ID: {ADMIN_USER_ID}")
     print(f"✅ Database: {DATABASE_TYPE}")
-    print(f"✅ Buffer System: ACTIVE (60-second batching)")
+    print(f"✅ Buffer System: ACTIVE (up to {FLUSH_MAX_LATENCY:g}s batching)")
     
     print("\n📋 CONFIGURED GROUPS:")
     for key, config in GROUPS.items():
@@ -1043,7 +3750,7 @@ if __name__ == '__main__':
     print("\n🌐 Server starting...")
     print("📡 Webhook: /webhook/router")
     print("🏠 Dashboard: http://localhost:5000")
-    print("⏳ Messages buffered for 60 seconds before sending")
+    print(f"⏳ Messages buffered up to {FLUSH_MAX_LATENCY:g} seconds before sending")
     print("═" * 70)
     print()
     
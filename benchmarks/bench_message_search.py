@@ -0,0 +1,107 @@
+"""
+Message search on a large SQLite messages table: search_messages (FTS5
+index) vs a LIKE scan over the same rows.
+
+Run from the repo root:
+    python benchmarks/bench_message_search.py [rows]
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+os.environ.setdefault('BUFFER_WAL_PATH', '')
+os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+GROUPS = [f'-100{g}' for g in range(10)]
+SYMBOLS = ['GOLD', 'XAUUSD', 'BTCUSD', 'ETHUSD', 'EURUSD', 'NIFTY', 'BANKNIFTY', 'CRUDE']
+EVENTS = ['entry triggered', 'target hit', 'stop loss hit', 'trailing stop moved', 'signal cancelled']
+RARE = 'breakaway gap'   # ~0.05% of rows
+PAGE = 50
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    rnd = random.Random(5)
+    now = int(time.time())
+    batch = []
+    for i in range(rows):
+        symbol = rnd.choice(SYMBOLS)
+        event = RARE if rnd.random() < 0.0005 else rnd.choice(EVENTS)
+        text = f'{symbol} {event} at {rnd.randint(100, 90000)} - alert {i}'
+        batch.append((now - (rows - i) * 30, text, rnd.choice(GROUPS), 'Group', symbol))
+        if len(batch) == 100000:
+            conn.executemany('INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords) '
+                             'VALUES (?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords) '
+                         'VALUES (?, ?, ?, ?, ?)', batch)
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat=10):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    workdir = tempfile.mkdtemp(prefix='bench_search_')
+    os.chdir(workdir)   # app uses ./unified_system.db in SQLite mode
+
+    import app
+    app.init_database()
+    conn = sqlite3.connect('unified_system.db')
+    conn.execute('DROP TABLE messages_fts')
+    conn.commit()
+    conn.close()
+
+    print(f"\nPopulating {rows:,} messages in {workdir} ...")
+    populate('unified_system.db', rows)
+
+    def like_scan(*words):
+        conn = sqlite3.connect('unified_system.db')
+        conn.execute('SELECT id, timestamp, message, group_id, group_name, matched_keywords FROM messages '
+                     'WHERE ' + ' AND '.join(['message LIKE ?'] * len(words)) + ' ORDER BY id DESC LIMIT ?',
+                     [f'%{w}%' for w in words] + [PAGE]).fetchall()
+        conn.close()
+
+    month_ago = int(time.time()) - 30 * 86400
+    print("\nLIKE scan (no index)")
+    print(f"  rare phrase              {timed(lambda: like_scan(RARE), 3):9.2f} ms")
+    print(f"  'target hit'             {timed(lambda: like_scan('target hit'), 3):9.2f} ms")
+    print(f"  no match (full scan)     {timed(lambda: like_scan('no such alert'), 3):9.2f} ms")
+
+    start = time.perf_counter()
+    app.init_database()   # Builds messages_fts from the existing rows
+    print(f"\nBuilt FTS5 index in {time.perf_counter() - start:.1f} s")
+
+    rare, common = f'"{RARE}"', '"target hit"'
+    print("\nsearch_messages (FTS5)")
+    print(f"  rare phrase              {timed(lambda: app.search_messages(rare, limit=PAGE)):9.2f} ms")
+    print(f"  rare phrase, group       {timed(lambda: app.search_messages(rare, GROUPS[2], limit=PAGE)):9.2f} ms")
+    print(f"  no match                 {timed(lambda: app.search_messages('no such alert', limit=PAGE)):9.2f} ms")
+    print(f"  GOLD target hit, 30 days {timed(lambda: app.search_messages('target hit', keyword='GOLD', since=month_ago, limit=PAGE), 3):9.2f} ms")
+    print(f"  'target hit' (ranked)    {timed(lambda: app.search_messages(common, limit=PAGE), 3):9.2f} ms")
+    print(f"  'target hit' (newest)    {timed(lambda: app.search_messages(common, limit=PAGE, sort='newest')):9.2f} ms")
+    print(f"  GOLD target hit (newest) {timed(lambda: app.search_messages('target hit', keyword='GOLD', since=month_ago, limit=PAGE, sort='newest')):9.2f} ms")
+    app.SEARCH_RANK_WINDOW = 0
+    print(f"  'target hit' (ranked, all matches) {timed(lambda: app.search_messages(common, limit=PAGE), 3):9.2f} ms")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Message history queries on a large SQLite messages table: no index vs
+(group_id, id) index, and OFFSET vs keyset (before_id) pagination.
+
+Run from the repo root:
+    python benchmarks/bench_messages_pagination.py [rows]
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+os.environ.setdefault('BUFFER_WAL_PATH', '')
+os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+
+GROUPS = [f'-100{g}' for g in range(10)]
+RARE_GROUP = '-2000'     # ~0.2% of rows - where a missing index hurts most
+PAGE = 50
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    rnd = random.Random(3)
+    batch = []
+    for i in range(rows):
+        group = RARE_GROUP if rnd.random() < 0.002 else rnd.choice(GROUPS)
+        batch.append((1767225600, f'alert {i} ' + 'x' * rnd.randint(20, 200), group, 'Group', 'KW'))
+        if len(batch) == 100000:
+            conn.executemany('INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords) '
+                             'VALUES (?, ?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        conn.executemany('INSERT INTO messages (timestamp, message, group_id, group_name, matched_keywords) '
+                         'VALUES (?, ?, ?, ?, ?)', batch)
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    workdir = tempfile.mkdtemp(prefix='bench_messages_')
+    os.chdir(workdir)   # app uses ./unified_system.db in SQLite mode
+
+    import app
+    app.init_database()
+    conn = sqlite3.connect('unified_system.db')
+    conn.execute('DROP INDEX idx_messages_group_id')
+    conn.close()
+
+    print(f"\nPopulating {rows:,} messages in {workdir} ...")
+    populate('unified_system.db', rows)
+
+    group = GROUPS[3]
+    deep_offset = rows // len(GROUPS) // 2        # Halfway through one group's history
+
+    def offset_page():
+        conn = sqlite3.connect('unified_system.db')
+        conn.execute('SELECT id, timestamp, message, matched_keywords FROM messages WHERE group_id = ? '
+                     'ORDER BY id DESC LIMIT ? OFFSET ?', (group, PAGE, deep_offset)).fetchall()
+        conn.close()
+
+    # Cursor for the same page the OFFSET query fetches
+    conn = sqlite3.connect('unified_system.db')
+    cursor_id = conn.execute('SELECT id FROM messages WHERE group_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+                             (group, deep_offset - 1)).fetchone()[0]
+    conn.close()
+
+    def run(label):
+        print(f"\n{label}")
+        print(f"  latest page (busy group)  {timed(lambda: app.get_messages_by_group(group, PAGE)):9.2f} ms")
+        print(f"  latest page (rare group)  {timed(lambda: app.get_messages_by_group(RARE_GROUP, PAGE), 5):9.2f} ms")
+        print(f"  deep page, OFFSET         {timed(offset_page, 3):9.2f} ms")
+        print(f"  deep page, before_id      {timed(lambda: app.get_messages_by_group(group, PAGE, before_id=cursor_id)):9.2f} ms")
+        print(f"  latest page (all groups)  {timed(lambda: app.get_all_messages(PAGE)):9.2f} ms")
+
+    run('Without (group_id, id) index')
+    app.init_database()   # Creates the indexes
+    run('With (group_id, id) index')
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Burst packing throughput: how fast pack_batch packs large alert bursts.
+Correctness (limit, ordering, no-split) is covered by tests/test_packing.py.
+
+Run from the repo root:
+    python benchmarks/bench_packing.py [alerts]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BUFFER_WAL_PATH', '')          # Keep benchmarks off the durable buffer
+os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+
+from app import pack_batch
+
+LIMIT = 4096
+
+
+def make_burst(count, rnd):
+    burst = []
+    for i in range(count):
+        if rnd.random() < 0.01:
+            length = rnd.randint(LIMIT + 1, LIMIT * 3)   # Oversized alert
+        else:
+            length = rnd.randint(20, 1500)
+        lines = []
+        while sum(len(l) + 1 for l in lines) < length:
+            lines.append(f"#{i} " + 'x' * rnd.randint(10, 120))
+        burst.append({'message': '\n'.join(lines)[:length], 'keyword': 'K', 'group_name': 'G'})
+    return burst
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rnd = random.Random(1)
+
+    for size in (1, 2, 10, 100, count):
+        burst = make_burst(size, rnd)
+        start = time.perf_counter()
+        parts = pack_batch(burst, LIMIT)
+        elapsed = time.perf_counter() - start
+        total = sum(len(m['message']) for m in burst)
+        print(f"{size:6d} alerts  {total:9d} chars -> {len(parts):5d} parts  {elapsed * 1000:8.2f} ms")
+
+    burst = make_burst(count, rnd)
+    start = time.perf_counter()
+    pack_batch(burst, LIMIT)
+    elapsed = time.perf_counter() - start
+    print(f"\npacking throughput: {count / elapsed:,.0f} alerts/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Keyword routing microbenchmark: naive per-group substring loop vs KeywordRouter.
+
+Run from the repo root:
+    python benchmarks/bench_router.py [groups] [keywords_per_group]
+"""
+
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BUFFER_WAL_PATH', '')          # Keep benchmarks off the durable buffer
+os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+
+from app import KeywordRouter
+
+
+def make_groups(n_groups, n_keywords):
+    rnd = random.Random(42)
+    groups = {}
+    for g in range(n_groups):
+        keywords = [''.join(rnd.choices(string.ascii_uppercase, k=rnd.randint(4, 10))) for _ in range(n_keywords)]
+        groups[f'G{g}'] = {'name': f'Group {g}', 'group_id': str(-1000 - g), 'keywords': keywords, 'enabled': True}
+    return groups
+
+
+def make_messages(groups, count):
+    rnd = random.Random(7)
+    all_keywords = [kw for g in groups.values() for kw in g['keywords']]
+    messages = []
+    for _ in range(count):
+        words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 8))) for _ in range(30)]
+        for kw in rnd.sample(all_keywords, 2):
+            words.insert(rnd.randrange(len(words)), kw)
+        messages.append(' '.join(words).upper())
+    return messages
+
+
+def naive_match(groups, message_upper):
+    matched = []
+    for key, cfg in groups.items():
+        if not cfg['enabled']:
+            continue
+        for keyword in cfg['keywords']:
+            if keyword.upper() in message_upper:
+                matched.append(key)
+                break
+    return matched
+
+
+def bench(label, fn, messages, rounds=5):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for msg in messages:
+            fn(msg)
+        best = min(best, time.perf_counter() - start)
+    per_msg_us = best / len(messages) * 1e6
+    print(f"{label:<16} {per_msg_us:10.2f} µs/message")
+    return per_msg_us
+
+
+def main():
+    n_groups = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_keywords = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    groups = make_groups(n_groups, n_keywords)
+    messages = make_messages(groups, 2000)
+    router = KeywordRouter(groups)
+
+    # Both strategies must agree on the set of destinations
+    for msg in messages:
+        assert sorted(k for k, _, _ in router.match(msg)) == sorted(naive_match(groups, msg))
+
+    print(f"\n{n_groups} groups × {n_keywords} keywords = {n_groups * n_keywords} keywords, {len(messages)} messages")
+    naive = bench('naive loop', lambda m: naive_match(groups, m), messages)
+    compiled = bench('KeywordRouter', router.match, messages)
+    print(f"speedup          {naive / compiled:10.1f}x  (router rebuilds: {router.rebuilds})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Cold-start cost: `python -X importtime` breakdown of `import app`, and the
+time from process start to the first answered webhook (boot() warms up in
+the background while the webhook is served).
+
+Run from the repo root:
+    python benchmarks/bench_startup.py [--runs 5] [--max-import-ms N]
+
+With --max-import-ms the script exits non-zero when the median import time
+is above N, so it can guard against startup regressions.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = dict(
+    os.environ,
+    BUFFER_WAL_PATH='',
+    ADMINS_REFRESH_INTERVAL='0',
+    LOG_LEVEL='WARNING',
+    TELEGRAM_API_BASE='http://127.0.0.1:9',   # Warm-up's getMe fails fast instead of leaving the machine
+    PYTHONPATH=REPO,
+    PYTHONDONTWRITEBYTECODE='',
+)
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)')
+
+FIRST_WEBHOOK = '''
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.boot()
+response = app.app.test_client().post('/webhook/router', data='GOLD buy above 2350', content_type='text/plain')
+answered = time.perf_counter()
+app.db_ready.wait(30)
+ready = time.perf_counter()
+assert response.status_code == 202, response.status_code
+print(imported - started, answered - started, ready - started)
+'''
+
+
+def run(args, cwd):
+    return subprocess.run([sys.executable] + args, cwd=cwd, env=ENV, capture_output=True, text=True, check=True)
+
+
+def import_profile(cwd, code):
+    """[(module, cumulative_us, depth)] in -X importtime order (children before their parent)"""
+    modules = []
+    for line in run(['-X', 'importtime', '-c', code], cwd).stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            _, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(cumulative_us), (len(indent) - 1) // 2))
+    return modules
+
+
+def cumulative_ms(profile, module):
+    return next(us for name, us, depth in profile if name == module and depth == 0) / 1000
+
+
+def direct_imports(profile, module):
+    """(cumulative_us, name) of the modules `module` itself imported"""
+    children = []
+    for name, us, depth in profile:
+        if depth == 0:
+            if name == module:
+                return children
+            children = []
+        elif depth == 1:
+            children.append((us, name))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float)
+    args = parser.parse_args()
+    runs = args.runs
+
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')   # app uses ./unified_system.db in SQLite mode
+    run(['-c', 'import app'], workdir)                    # Warm the OS file cache and create the database
+
+    profiles = [import_profile(workdir, 'import app') for _ in range(runs)]
+    app_ms = statistics.median(cumulative_ms(p, 'app') for p in profiles)
+    eager = [import_profile(workdir, 'import requests, app') for _ in range(runs)]
+    eager_ms = statistics.median(cumulative_ms(p, 'requests') + cumulative_ms(p, 'app') for p in eager)
+
+    print(f"\nimport app (median of {runs})         {app_ms:8.1f} ms")
+    print(f"  ... if requests were imported eagerly {eager_ms:8.1f} ms")
+    print("\nSlowest imports under app (cumulative, last run)")
+    for cumulative, name in sorted(direct_imports(profiles[-1], 'app'), reverse=True)[:8]:
+        print(f"  {name:36} {cumulative / 1000:8.1f} ms")
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        imported, answered, ready = map(float, run(['-c', FIRST_WEBHOOK], workdir).stdout.split())
+        timings.append((imported, answered, ready, time.perf_counter() - start))
+    imported, answered, ready, total = (statistics.median(t[i] for t in timings) * 1000 for i in range(4))
+    print(f"\nFirst webhook after process start (median of {runs})")
+    print(f"  app imported                  {imported:8.1f} ms")
+    print(f"  first webhook answered        {answered:8.1f} ms")
+    print(f"  warm-up done (tables, pool)   {ready:8.1f} ms")
+    print(f"  process exit (incl. interpreter) {total:7.1f} ms")
+
+    if args.max_import_ms is not None and app_ms > args.max_import_ms:
+        print(f"\n❌ import app took {app_ms:.1f} ms (limit {args.max_import_ms:g} ms)")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
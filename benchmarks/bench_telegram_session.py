@@ -0,0 +1,108 @@
+"""
+Connection reuse of the shared Telegram session versus a connection per call,
+against a local mock Bot API. The reuse guarantee itself is covered by
+tests/test_telegram_session.py.
+
+Run from the repo root:
+    python benchmarks/bench_telegram_session.py [calls] [threads]
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RESULTS = {
+    'sendMessage': True,
+    'getChatMember': {'status': 'member'},
+    'getChat': {'id': 1, 'username': 'mock_user'},
+    'getChatAdministrators': [{'user': {'id': 1, 'first_name': 'Admin'}, 'status': 'creator'}],
+    'createChatInviteLink': {'invite_link': 'https://t.me/+mock'},
+    'banChatMember': True,
+    'unbanChatMember': True,
+}
+
+
+class MockBotAPI(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep-alive
+    connections = 0
+    requests_seen = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without NODELAY, Nagle + delayed ACK
+        # stalls every keep-alive response on loopback
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with MockBotAPI.lock:
+            MockBotAPI.connections += 1
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        method = self.path.split('?')[0].rsplit('/', 1)[-1]
+        body = json.dumps({'ok': True, 'result': RESULTS.get(method, True)}).encode()
+        with MockBotAPI.lock:
+            MockBotAPI.requests_seen += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def run(label, calls, threads, fn):
+    MockBotAPI.connections = 0
+    MockBotAPI.requests_seen = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(fn, range(calls)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {MockBotAPI.requests_seen:5d} requests over {MockBotAPI.connections:4d} connections "
+          f"({elapsed * 1000 / calls:.2f} ms/call)")
+    return MockBotAPI.requests_seen, MockBotAPI.connections
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['TELEGRAM_API_BASE'] = f'http://127.0.0.1:{server.server_port}'
+    os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+    os.environ.setdefault('BUFFER_WAL_PATH', '')
+
+    import requests
+    import app
+
+    url = app.telegram_url('getChat')   # Same uncached call in both arms
+
+    def per_call_connection(i):
+        requests.post(url, json={'chat_id': str(i)}, timeout=10)
+
+    def shared_session(i):
+        app.get_telegram_session().post(url, json={'chat_id': str(i)}, timeout=app.TELEGRAM_TIMEOUT)
+
+    print(f"\n{calls} Bot API calls from {threads} threads")
+    run('requests.post per call', calls, threads, per_call_connection)
+    seen, connections = run('shared session', calls, threads, shared_session)
+    print(f"reuse                  {seen / connections:.0f} requests per connection")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Webhook load test: fires TradingView-style alerts at /webhook/router and
+reports p50/p90/p99 latency and requests/second.
+
+Run from the repo root, either against a running server:
+    python benchmarks/loadtest_webhook.py --url http://127.0.0.1:5000/webhook/router
+or in-process (threaded WSGI server, Telegram sends stubbed out):
+    python benchmarks/loadtest_webhook.py [--requests 5000] [--concurrency 50]
+"""
+
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ALERTS = [
+    'GOLD buy above 2350 target 2365 SL 2340',
+    'CRUDE short below 6500',
+    'NIFTY OPTION 22500 CE buy',
+    'ZONE demand 1450-1460 SILVER',
+    'unrouted alert text',
+]
+
+
+def start_in_process_server():
+    os.environ.setdefault('BUFFER_WAL_PATH', '')
+    os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')       # Keep per-alert log lines out of the measurement
+    os.environ.setdefault('ALERT_DEDUP_WINDOW', '0')    # The same few alert texts repeat; measure routing, not dedup
+    import tempfile
+    os.chdir(tempfile.mkdtemp(prefix='loadtest_'))
+
+    import app
+    from werkzeug.serving import make_server
+    app.init_database()
+    app.send_to_telegram = lambda group_id, text: True
+    app.start_background_workers()   # No warm-up: it would contact the real Bot API
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/webhook/router', app
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    url, app = (args.url, None) if args.url else start_in_process_server()
+    target = urlparse(url)
+    local = threading.local()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def fire(i):
+        # One keep-alive connection per client thread, like TradingView's senders
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        body = ALERTS[i % len(ALERTS)].encode()
+        start = time.perf_counter()
+        try:
+            conn.request('POST', target.path, body=body, headers={'Content-Type': 'text/plain'})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except Exception as e:
+            local.conn = None
+            status = repr(e)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status not in (200, 202):
+                errors.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(fire, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"\n{args.requests} requests, concurrency {args.concurrency} -> {url}")
+    print(f"  throughput  {args.requests / wall:10.0f} req/s")
+    for pct in (50, 90, 99):
+        print(f"  p{pct:<9} {percentile(latencies, pct) * 1000:10.2f} ms")
+    print(f"  max         {latencies[-1] * 1000:10.2f} ms")
+    print(f"  errors      {len(errors):10d}")
+    if app is not None:
+        print(f"  mode        {'async ingest' if app.WEBHOOK_ASYNC_INGEST else 'sync ingest'}")
+
+
+if __name__ == '__main__':
+    main()
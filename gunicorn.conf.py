@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for production (Procfile / render.yaml):
+    gunicorn -c gunicorn.conf.py app:app
+
+One worker process with many threads by default: the message buffer, flush
+scheduler and caches live in-process, and threads also keep /api/events
+streams open without blocking webhook requests. To run several workers (or
+instances), set BUFFER_BACKEND=sql so all of them share one buffer table and
+the expiry sweeper / retention jobs run on one worker at a time.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+timeout = 30                # Worker heartbeat - gthread workers keep beating while SSE streams stay open
+graceful_timeout = 30
+keepalive = 75              # Reuse TradingView / dashboard connections
+accesslog = None            # No per-request console I/O on the hot path
+errorlog = '-'
+loglevel = 'warning'
+
+
+def post_worker_init(worker):
+    """Start background workers and warm up (tables, DB pool, Bot API connection) without
+    delaying the first webhook"""
+    from app import boot
+    boot()
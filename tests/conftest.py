@@ -0,0 +1,17 @@
+"""
+Test setup: import app from the repo root, with background features that would
+touch the disk or the network switched off.
+
+Run from the repo root:
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BUFFER_WAL_PATH', '')
+os.environ.setdefault('ADMINS_REFRESH_INTERVAL', '0')
+os.environ.setdefault('EXPIRY_SWEEP_INTERVAL', '0')
+os.environ.setdefault('RETENTION_INTERVAL', '0')
+os.environ.setdefault('TELEGRAM_API_BASE', 'http://127.0.0.1:9')   # Nothing leaves the machine
@@ -0,0 +1,83 @@
+"""pack_batch: Telegram limit, ordering and no-split guarantees on large alert bursts"""
+
+import random
+
+import pytest
+
+from app import BATCH_SEPARATOR, pack_batch
+
+LIMIT = 4096
+
+
+def make_burst(count, rnd):
+    """count alerts of 20-1500 chars, about 1% of them over the limit"""
+    burst = []
+    for i in range(count):
+        if rnd.random() < 0.01:
+            length = rnd.randint(LIMIT + 1, LIMIT * 3)   # Oversized alert
+        else:
+            length = rnd.randint(20, 1500)
+        lines = []
+        while sum(len(l) + 1 for l in lines) < length:
+            lines.append(f"#{i} " + 'x' * rnd.randint(10, 120))
+        burst.append({'message': '\n'.join(lines)[:length], 'keyword': 'K', 'group_name': 'G'})
+    return burst
+
+
+def alert(message):
+    return {'message': message, 'keyword': 'K', 'group_name': 'G'}
+
+
+@pytest.mark.parametrize('size', [1, 2, 10, 100, 1000, 5000])
+def test_large_bursts(size):
+    burst = make_burst(size, random.Random(size))
+    parts = pack_batch(burst, LIMIT)
+
+    assert all(len(p['text']) <= LIMIT for p in parts), "part over the limit"
+
+    # Every alert is delivered exactly once, in order
+    acked = [id(m) for p in parts for m in p['acks']]
+    assert acked == [id(m) for m in burst], "alerts lost, duplicated or reordered"
+
+    # Alerts within the limit are never split across parts
+    for m in burst:
+        if len(m['message']) <= LIMIT:
+            holders = [p for p in parts if any(x is m for x in p['msgs'])]
+            assert len(holders) == 1 and m['message'] in holders[0]['text'].split(BATCH_SEPARATOR)
+
+    # Greedy is optimal for in-order packing: no two neighbouring parts of whole alerts could be merged
+    def packable(part):
+        return all(len(m['message']) <= LIMIT for m in part['msgs'])
+
+    for a, b in zip(parts, parts[1:]):
+        if packable(a) and packable(b):
+            assert len(a['text']) + len(BATCH_SEPARATOR) + len(b['msgs'][0]['message']) > LIMIT
+
+
+def test_small_alerts_share_one_part():
+    burst = [alert(f"alert {i}") for i in range(50)]
+    parts = pack_batch(burst, LIMIT)
+    assert len(parts) == 1
+    assert parts[0]['text'] == BATCH_SEPARATOR.join(m['message'] for m in burst)
+
+
+def test_oversized_alert_is_acked_by_its_last_chunk():
+    big = alert('y' * (LIMIT * 2 + 10))
+    burst = [alert('before'), big, alert('after')]
+    parts = pack_batch(burst, LIMIT)
+
+    chunks = [p for p in parts if p['msgs'] == [big]]
+    assert len(chunks) == 3
+    assert [p['acks'] for p in chunks] == [[], [], [big]]
+    assert ''.join(p['text'] for p in chunks).replace('\n', '') == big['message']
+    assert parts[0]['text'] == 'before' and parts[-1]['text'] == 'after'
+
+
+def test_alert_exactly_at_the_limit_is_not_split():
+    burst = [alert('z' * LIMIT), alert('z' * LIMIT)]
+    parts = pack_batch(burst, LIMIT)
+    assert [len(p['text']) for p in parts] == [LIMIT, LIMIT]
+
+
+def test_empty_burst():
+    assert pack_batch([], LIMIT) == []
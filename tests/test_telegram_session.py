@@ -0,0 +1,89 @@
+"""Bot API calls reuse the shared keep-alive session's connections (against a local mock Bot API)"""
+
+import json
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+RESULTS = {
+    'sendMessage': True,
+    'getChatMember': {'status': 'member'},
+    'getChat': {'id': 1, 'username': 'mock_user'},
+    'getChatAdministrators': [{'user': {'id': 1, 'first_name': 'Admin'}, 'status': 'creator'}],
+    'createChatInviteLink': {'invite_link': 'https://t.me/+mock'},
+    'banChatMember': True,
+    'unbanChatMember': True,
+}
+
+
+class MockBotAPI(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep-alive
+    connections = 0
+    requests_seen = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with MockBotAPI.lock:
+            MockBotAPI.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        method = self.path.rsplit('/', 1)[-1]
+        body = json.dumps({'ok': True, 'result': RESULTS.get(method, True)}).encode()
+        with MockBotAPI.lock:
+            MockBotAPI.requests_seen += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def bot_api(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockBotAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    MockBotAPI.connections = MockBotAPI.requests_seen = 0
+
+    monkeypatch.chdir(tmp_path)   # Keep any SQLite file out of the repo
+    monkeypatch.setattr(app, 'TELEGRAM_API_BASE', f'http://127.0.0.1:{server.server_port}')
+    monkeypatch.setattr(app, 'telegram_session', None)   # A fresh session for this server
+    # Lift the rate limits - this checks connection reuse, not Telegram's quotas
+    monkeypatch.setattr(app, 'global_send_bucket', app.TokenBucket(1e9, 1e9))
+    monkeypatch.setattr(app, 'admin_call_bucket', app.TokenBucket(1e9, 1e9))
+    monkeypatch.setattr(app, 'get_chat_bucket', lambda chat_id: app.TokenBucket(1e9, 1e9))
+    yield MockBotAPI
+    if app.telegram_session is not None:
+        app.telegram_session.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_calls_share_keep_alive_connections(bot_api):
+    calls = [
+        lambda i: app.send_to_telegram('-100', 'hello') is True,
+        lambda i: app.check_user_in_group('-100', str(i)) is True,
+        lambda i: app.get_user_info(str(i)) is not None,
+        lambda i: app.create_invite_link('-100') == 'https://t.me/+mock',
+        lambda i: app.ban_user_from_group('-100', str(i)) is True,
+    ]
+    count = 200
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: calls[i % len(calls)](i), range(count)))
+
+    assert all(results)
+    assert bot_api.requests_seen >= count
+    assert bot_api.connections <= min(8, app.TELEGRAM_POOL_SIZE), \
+        f"expected connection reuse, got {bot_api.connections} connections for {bot_api.requests_seen} requests"